@@ -23,10 +23,13 @@ Classes & Functions
 
 # imports
 from ._smiles_parsing import MolFromSmiles, MolToSmiles
-from ._substituents import AddSubsToMol
+from ._substituents import AddSubsToMol, IterSubsCombinations
 from ._complex_object import Complex
 from ._complex_init_mols import ComplexFromMol, ComplexFromLigands
-from ._complex_init_files import ComplexFromXYZFile
+from ._complex_init_files import ComplexFromXYZFile, IterXYZFile, \
+                                 ComplexFromEnsembleFile, ReadEnsembleFile
+from ._cache import SetComparisonCache, GetComparisonCacheInfo, ClearComparisonCache
+from ._stats import EnableStats
 
 # package info
 __author__ = "Ivan Yu. Chernyshov"
@@ -36,8 +39,11 @@ __version__ = '0.5.0'
 # module functions
 __all__ = [
     'Complex',
-    'ComplexFromMol', 'ComplexFromLigands', 'ComplexFromXYZFile',
-    'MolFromSmiles', 'MolToSmiles', 'AddSubsToMol'
+    'ComplexFromMol', 'ComplexFromLigands', 'ComplexFromXYZFile', 'IterXYZFile',
+    'ComplexFromEnsembleFile', 'ReadEnsembleFile',
+    'MolFromSmiles', 'MolToSmiles', 'AddSubsToMol', 'IterSubsCombinations',
+    'SetComparisonCache', 'GetComparisonCacheInfo', 'ClearComparisonCache',
+    'EnableStats'
 ]
 
 # disable logger
@@ -2,11 +2,13 @@
 
 #%% Imports
 
-import re, sys, os
-import argparse, yaml
-from itertools import product
+import re, sys, os, time
+import argparse, yaml, json, hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import mace
+from mace._cli_queue import TaskQueue, get_worker_name
 
 
 #%% Preparing arguments
@@ -36,6 +38,12 @@ def get_parser():
         'out_dir', type = str, nargs = '?', default = './',
         help = 'directory to store epic-mace output'
     )
+    parser.add_argument(
+        '--format', type = str, default = 'xyz', choices = ['xyz', 'npz'],
+        help = 'format of output files:\n'
+               '  - xyz: multiple XYZ file\n'
+               '  - npz: binary ensemble file (see mace.Complex.ToEnsembleFile)'
+    )
     inpf = parser.add_argument_group(title = 'Input file')
     inpf.add_argument(
         '--input', type = str,
@@ -144,6 +152,64 @@ def get_parser():
         '--substituents-file', type = str, default = './substituents.yaml',
         help = 'YAML-formatted file containing substituents\' name-SMILES mapping; required '
     )
+    # execution
+    execution = parser.add_argument_group(
+        title = 'Execution',
+        description = 'Parameters of the job execution'
+    )
+    execution.add_argument(
+        '--n-jobs', type = int, default = 1,
+        help = 'number of worker processes used for stereomer search and 3D generation. '
+               'If 1, all systems are processed sequentially'
+    )
+    execution.add_argument(
+        '--resume', action = 'store_true',
+        help = 'skips systems which output in out_dir is complete and was generated '
+               'with the same parameters (according to the manifest file). '
+               'Can be used together with --input'
+    )
+    execution.add_argument(
+        '--queue', type = str, default = None,
+        help = 'path to SQLite database; if specified, stereomers of all systems '
+               'are added to this queue instead of 3D generation, which is '
+               'performed by "epic-mace-worker DB" processes. '
+               'Can be used together with --input, but not with --resume'
+    )
+    
+    return parser
+
+
+def get_worker_parser():
+    '''Generates CLI parser for the worker processing the queue'''
+    parser = argparse.ArgumentParser(
+        prog = 'epic-mace-worker',
+        description = 'Processes 3D generation tasks from the queue filled by '
+                      'epic-mace --queue. Any number of workers can run on '
+                      'different nodes sharing the filesystem with the queue'
+    )
+    parser.add_argument(
+        'queue', type = str,
+        help = 'path to the SQLite database of the queue'
+    )
+    parser.add_argument(
+        '--lease', type = float, default = 3600.0,
+        help = 'time in seconds for which the task is claimed; tasks of lost '
+               'workers are returned to the queue after the lease expires'
+    )
+    parser.add_argument(
+        '--max-attempts', type = int, default = 3,
+        help = 'maximal number of attempts per task'
+    )
+    parser.add_argument(
+        '--max-tasks', type = int, default = None,
+        help = 'maximal number of tasks to process; if not specified, the worker '
+               'stops when the queue is empty'
+    )
+    parser.add_argument(
+        '--poll', type = float, default = 10.0,
+        help = 'time in seconds between checks of the queue while tasks '
+               'claimed by other workers are running'
+    )
     
     return parser
 
@@ -199,8 +265,12 @@ def read_arguments():
     args, unknown = parser.parse_known_args()
     # read from input file
     if args.input:
+        resume, queue = args.resume, args.queue
         cmd = args_to_command(get_args_from_file(args.input))
         args, unknown = parser.parse_known_args(cmd)
+        # restarting or queueing the job must not require editing the input file
+        args.resume = args.resume or resume
+        args.queue = queue or args.queue
     # parse substituents
     subs_args = read_subs(unknown)
     
@@ -300,6 +370,7 @@ def check_arguments(args):
     if not os.path.isdir(args['out_dir']):
         raise MaceInputError('Specified output directory does not exist')
     params['out_dir'] = args['out_dir']
+    params['format'] = args['format']
     
     # check structure
     for key in ('name', 'geom'):
@@ -366,6 +437,16 @@ def check_arguments(args):
     for key in ('num_repr_confs', 'e_rel_max', 'drop_close_energy'):
         params[key] = args[key]
     
+    # execution
+    if args['n_jobs'] < 1:
+        raise MaceInputError('--n-jobs must be a positive integer')
+    params['n_jobs'] = args['n_jobs']
+    params['resume'] = args['resume']
+    params['queue'] = args['queue']
+    # workers do not update the manifest; the queue skips queued systems itself
+    if params['resume'] and params['queue']:
+        raise MaceInputError('--resume cannot be used together with --queue')
+    
     # get subs
     struct = 'complex' if 'complex' in params else 'ligands'
     subs = get_subs(args, struct)
@@ -377,119 +458,510 @@ def check_arguments(args):
 
 #%% Generation
 
-def prepare_complexes(params):
-    '''Prepares complexes for stereomer search'''
+def relabel_donor_atoms(mol):
+    '''Sets the same labels to all donor atoms of the molecule in place,
+    so that the stereomer search does not depend on the initial labels
+    '''
+    for b in mol.GetBonds():
+        if str(b.GetBondType()) == 'DATIVE':
+            b.GetBeginAtom().SetAtomMapNum(1)
+            b.GetBeginAtom().SetIsotope(1)
+    
+    return mol
+
+
+def iter_systems(params):
+    '''Yields names and molecules of systems, one per combination of
+    substituents. Substituents are attached incrementally
+    '''
+    core = mace.MolFromSmiles(params['complex'])
+    if params['regime'] in ('CA', 'all'):
+        relabel_donor_atoms(core)
+    if not params['subs']:
+        yield params['name'], core
+        return
+    names = [[name for name, _ in subs] for subs in params['subs'].values()]
+    Rs = {R: [mace.MolFromSmiles(smi) for _, smi in subs] for R, subs in params['subs'].items()}
+    for idxs, mol in mace.IterSubsCombinations(core, Rs):
+        sub_names = [names[j][i] for j, i in enumerate(idxs)]
+        yield f'{params["name"]}_{"_".join(sub_names)}', mol
+
+
+def iter_complexes(params, dropped = None):
+    '''Yields unique complexes for stereomer search. Repeating combinations
+    of substituents are detected by canonical SMILES before complexes are
+    built; names of dropped systems are appended to the dropped list
+    '''
+    if dropped is None:
+        dropped = []
     # combine ligands to complex
     if 'complex' not in params:
         X = mace.ComplexFromLigands(params['ligands'], params['CA'], params['geom'])
         params['complex'] = mace.MolToSmiles(X.mol)
-    # add subs
-    core = mace.MolFromSmiles(params['complex'])
-    systems = []
-    if not params['subs']:
-        X = mace.ComplexFromMol(core, params['geom'], params['res_structs'])
-        if params['regime'] not in ('none', 'ligands'):
-            for idx in X._DAs:
-                X.mol.GetAtomWithIdx(idx).SetAtomMapNum(1)
-                X.mol.GetAtomWithIdx(idx).SetIsotope(1)
-            X = mace.ComplexFromMol(X.mol, X.geom)
-        systems.append( (params['name'], X) )
-    else:
-        Rs = list(params['subs'].keys())
-        for subs_info in product(*params['subs'].values()):
-            # prepare subs
-            sub_names, sub_smis = zip(*subs_info)
-            fullname = f'{params["name"]}_{"_".join(sub_names)}'
-            subs = {R: mace.MolFromSmiles(smi) for R, smi in zip(Rs, sub_smis)}
-            # get base complex
-            mol = mace.AddSubsToMol(core, subs)
-            X = mace.ComplexFromMol(mol, params['geom'], params['res_structs'])
-            # reset map numbers
-            if params['regime'] != 'none':
-                for idx in X._DAs:
-                    X.mol.GetAtomWithIdx(idx).SetAtomMapNum(1)
-                    X.mol.GetAtomWithIdx(idx).SetIsotope(1)
-                X = mace.ComplexFromMol(X.mol, X.geom)
-            systems.append( (fullname, X) )
-    # get repeating complexes
-    repeats = []
-    if params['regime'] == 'none':
-        # compare them as complexes
-        N = len(systems)
-        for i in range(N - 1):
-            name_i, X_i = systems[i]
-            if name_i in repeats:
+    # get unique complexes
+    seen = set()
+    ids = set()
+    for fullname, mol in iter_systems(params):
+        key = mace.MolToSmiles(mol)
+        if key in seen:
+            dropped.append(fullname)
+            continue
+        seen.add(key)
+        X = mace.ComplexFromMol(mol, params['geom'], params['res_structs'])
+        # the same complex with different labels of donor atoms
+        if params['regime'] == 'none' and not X.err_init:
+            if not ids.isdisjoint(X._ID):
+                dropped.append(fullname)
                 continue
-            for j in range(i + 1, N):
-                name_j, X_j = systems[j]
-                if X_i.IsEqual(X_j):
-                    repeats.append(name_j)
+            ids.update(X._ID)
+        yield fullname, X
+    
+    return
+
+
+def iter_isomers(X, fullname, params):
+    '''Yields stereomers of the complex which will be used for 3D generation'''
+    if params['regime'] == 'none':
+        if X.err_init:
+            raise MaceInputError(f'{fullname}:\n{X.err_init}')
+        return iter([X])
+    
+    return X.IterStereomers(params['regime'], not params['get_enantiomers'],
+                            params['trans_cycle'], params['mer_rule'])
+
+
+def get_isomers(X, fullname, params):
+    '''Returns stereomers of the complex which will be used for 3D generation'''
+    
+    return list(iter_isomers(X, fullname, params))
+
+
+def add_conformers(X, params):
+    '''Generates conformers for the stereomer'''
+    X.AddConformers(numConfs = params['num_confs'],
+                    rmsThresh = params['rms_thresh'])
+    X.OrderConfsByEnergy()
+    
+    return
+
+
+def get_isomer_path(fullname, i, params):
+    '''Returns path to the output file of the i-th stereomer'''
+    
+    return os.path.join(params['out_dir'], fullname, f'{fullname}_iso{i}.{params["format"]}')
+
+
+def save_isomer(X, i, fullname, params):
+    '''Saves conformers of the i-th stereomer as xyz or npz file; returns
+    False if the stereomer has no conformers
+    '''
+    if not X.GetNumConformers():
+        return False
+    # save file
+    path = get_isomer_path(fullname, i, params)
+    if params['num_repr_confs']:
+        idxs = X.GetRepresentativeConfs(params['num_repr_confs'],
+                                        params['e_rel_max'],
+                                        params['drop_close_energy'])
     else:
-        # compare as mol SMILES
-        N = len(systems)
-        for i in range(N - 1):
-            name_i, X_i = systems[i]
-            if name_i in repeats:
-                continue
-            smi_i = mace.MolToSmiles(X_i.mol)
-            for j in range(i + 1, N):
-                name_j, X_j = systems[j]
-                smi_j = mace.MolToSmiles(X_j.mol)
-                if smi_i == smi_j:
-                    repeats.append(name_j)
-    # drop repeats
-    systems = {name: X for name, X in systems if name not in repeats}
+        idxs = None
+    if params['format'] == 'npz':
+        X.ToEnsembleFile(path, idxs)
+    else:
+        X.ToMultipleXYZ(path, idxs)
+    
+    return True
+
+
+def print_info(fullname, n_iso, no_confs, errors = None, infeasible = None):
+    '''Prints info message on the processed system'''
+    msg = f'{fullname}: found {n_iso} isomers'
+    if no_confs:
+        bad_idxs = ', '.join([str(_) for _ in no_confs])
+        msg += f'; no confs generated for isomers ## {bad_idxs}'
+        for i in sorted(infeasible or {}):
+            msg += f'\n  iso{i}: {infeasible[i]}'
+    if errors:
+        bad_idxs = ', '.join([str(_) for _ in sorted(errors)])
+        msg += f'; errors for isomers ## {bad_idxs}'
+        for i in sorted(errors):
+            msg += f'\n  iso{i}: {errors[i]}'
+    print(msg)
     
-    return systems
+    return
 
 
-def save_isomers(Xs, fullname, params):
-    '''Saves generated structures as xyz files'''
+def run_mace_for_system(X, fullname, params):
+    '''Generates stereomers and conformers for the complex; returns
+    indexes of stereomers saved to output files and errors of 3D
+    generation by stereomer index. Each stereomer is embedded and
+    saved as soon as it is found
+    '''
     # complex dir
     path_dir = os.path.join(params['out_dir'], fullname)
     if not os.path.exists(path_dir):
         os.mkdir(path_dir)
-    # save xyz-files
-    info = {'n_iso': len(Xs), 'no_confs': []}
-    for i, X in enumerate(Xs):
-        if not X.GetNumConformers():
-            info['no_confs'].append(i)
+    # stereomers & conformers
+    n_iso = 0
+    no_confs = []
+    errors = {}
+    infeasible = {}
+    for i, X in enumerate(iter_isomers(X, fullname, params)):
+        n_iso += 1
+        try:
+            add_conformers(X, params)
+            has_confs = save_isomer(X, i, fullname, params)
+        except Exception as e:
+            errors[i] = _error_message(e)
             continue
-        path = os.path.join(path_dir, f'{fullname}_iso{i}.xyz')
-        if params['num_repr_confs']:
-            idxs = X.GetRepresentativeConfs(params['num_repr_confs'],
-                                            params['e_rel_max'],
-                                            params['drop_close_energy'])
-        else:
-            idxs = None
-        X.ToMultipleXYZ(path, idxs)
+        if not has_confs:
+            no_confs.append(i)
+            if X.err_embed:
+                infeasible[i] = X.err_embed
     # print info message
-    msg = f'{fullname}: found {info["n_iso"]} isomers'
-    if info['no_confs']:
-        bad_idxs = ', '.join([str(_) for _ in info["no_confs"]])
-        msg += f'; no confs generated for isomers ## {bad_idxs}'
-    print(msg)
+    print_info(fullname, n_iso, no_confs, errors, infeasible)
+    saved = [i for i in range(n_iso) if i not in no_confs and i not in errors]
+    
+    return saved, errors
+
+
+
+#%% Manifest
+
+MANIFEST_NAME = 'mace_manifest.jsonl'
+MANIFEST_PARAMS = ('format', 'geom', 'res_structs',
+                   'regime', 'get_enantiomers', 'trans_cycle', 'mer_rule',
+                   'num_confs', 'rms_thresh',
+                   'num_repr_confs', 'e_rel_max', 'drop_close_energy')
+
+
+def read_manifest(params):
+    '''Reads the manifest file describing systems stored in out_dir;
+    the manifest is a log of records, and the last record of the system
+    describes its current state
+    '''
+    path = os.path.join(params['out_dir'], MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return {}
+    manifest = {}
+    with open(path, 'r') as inpf:
+        for line in inpf:
+            if not line.strip():
+                continue
+            # records cut by the interrupted run are skipped
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(entry, dict) or 'name' not in entry:
+                raise MaceInputError(f'Bad-formatted manifest file: {path}')
+            manifest[entry.pop('name')] = entry
+    
+    return manifest
+
+
+def write_manifest(fullname, manifest, params):
+    '''Appends the record of the system to the manifest file'''
+    path = os.path.join(params['out_dir'], MANIFEST_NAME)
+    entry = {'name': fullname, **manifest[fullname]}
+    text = json.dumps(entry, sort_keys = True) + '\n'
+    # the record cut by the interrupted run must not spoil the new one
+    if os.path.isfile(path) and os.path.getsize(path) > 0:
+        with open(path, 'rb') as inpf:
+            inpf.seek(-1, os.SEEK_END)
+            if inpf.read(1) != b'\n':
+                text = '\n' + text
+    with open(path, 'a') as outf:
+        outf.write(text)
     
     return
 
 
-def run_mace_for_system(X, fullname, params):
-    '''Generates stereomers and conformers for the complex'''
-    # stereomers
-    if params['regime'] == 'none':
-        if X.err_init:
-            raise MaceInputError(f'{fullname}:\n{X.err_init}')
-        Xs = [X]
+def get_system_hash(X, params):
+    '''Returns hash of the system's SMILES and all parameters
+    affecting the output
+    '''
+    info = {key: params[key] for key in MANIFEST_PARAMS}
+    info['smiles'] = mace.MolToSmiles(X.mol)
+    text = json.dumps(info, sort_keys = True)
+    
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def is_system_complete(fullname, system_hash, manifest, params):
+    '''Checks if the output for the system is complete and matches its hash'''
+    entry = manifest.get(fullname)
+    if not entry or entry['status'] != 'complete' or entry['hash'] != system_hash:
+        return False
+    for i in entry['isomers']:
+        if not os.path.isfile(get_isomer_path(fullname, i, params)):
+            return False
+    
+    return True
+
+
+def clear_system_dir(fullname, params):
+    '''Removes output files remaining from the previous run of the system'''
+    path_dir = os.path.join(params['out_dir'], fullname)
+    if not os.path.isdir(path_dir):
+        return
+    for name in os.listdir(path_dir):
+        if re.search(rf'^{re.escape(fullname)}_iso\d+\.(xyz|npz)$', name):
+            os.remove(os.path.join(path_dir, name))
+    
+    return
+
+
+def start_system(fullname, system_hash, manifest, params):
+    '''Marks the system as being generated in the manifest'''
+    manifest[fullname] = {'hash': system_hash, 'status': 'running', 'isomers': []}
+    write_manifest(fullname, manifest, params)
+    clear_system_dir(fullname, params)
+    
+    return
+
+
+def finish_system(fullname, saved, manifest, params):
+    '''Marks the system as completed in the manifest'''
+    manifest[fullname]['status'] = 'complete'
+    manifest[fullname]['isomers'] = saved
+    write_manifest(fullname, manifest, params)
+    
+    return
+
+
+def fail_system(fullname, saved, error, manifest, params):
+    '''Marks the system as failed in the manifest; output files of
+    stereomers generated before the error are kept
+    '''
+    manifest[fullname]['status'] = 'failed'
+    manifest[fullname]['isomers'] = saved
+    manifest[fullname]['error'] = error
+    write_manifest(fullname, manifest, params)
+    
+    return
+
+
+def format_errors(errors):
+    '''Joins errors of 3D generation by stereomer index into one message'''
+    
+    return '\n'.join([f'iso{i}: {errors[i]}' for i in sorted(errors)])
+
+
+def iter_jobs(systems, manifest, params):
+    '''Yields systems to be generated with hashes; if resume is set,
+    systems with complete output are skipped
+    '''
+    for fullname, X in systems:
+        system_hash = get_system_hash(X, params)
+        if params['resume'] and is_system_complete(fullname, system_hash, manifest, params):
+            print(f'{fullname}: skipped, output is complete')
+            continue
+        yield fullname, X, system_hash
+    
+    return
+
+
+
+#%% Parallel generation
+
+def _error_message(e):
+    '''Formats exception caught in a worker process'''
+    
+    return f'{type(e).__name__}: {e}'.strip()
+
+
+def _task_isomers(X, fullname, params):
+    '''Worker task: stereomer search for the system'''
+    try:
+        return get_isomers(X, fullname, params), None
+    except Exception as e:
+        return None, _error_message(e)
+
+
+def _task_conformers(X, i, fullname, params):
+    '''Worker task: 3D generation and saving of the i-th stereomer'''
+    try:
+        add_conformers(X, params)
+        return save_isomer(X, i, fullname, params), X.err_embed, None
+    except Exception as e:
+        return False, None, _error_message(e)
+
+
+def _submit_conformers(pool, task, params):
+    '''Submits 3D generation of stereomers of the system; the stereomer
+    search must be finished
+    '''
+    Xs, task['err'] = task['search'].result()
+    if task['err'] is not None:
+        return
+    path_dir = os.path.join(params['out_dir'], task['name'])
+    if not os.path.exists(path_dir):
+        os.mkdir(path_dir)
+    task['futures'] = [pool.submit(_task_conformers, X, i, task['name'], params) \
+                       for i, X in enumerate(Xs)]
+    
+    return
+
+
+def _submit_ready(pool, tasks, params):
+    '''Submits 3D generation for systems with finished stereomer search'''
+    for task in tasks:
+        if task['futures'] is None and task['err'] is None and task['search'].done():
+            _submit_conformers(pool, task, params)
+    
+    return
+
+
+def _collect_system(pool, task, manifest, params):
+    '''Waits for the results of the system and prints info message'''
+    if task['futures'] is None and task['err'] is None:
+        _submit_conformers(pool, task, params)
+    fullname, futures = task['name'], task['futures']
+    if task['err'] is not None:
+        print(f'{fullname}: stereomer search failed\n  {task["err"]}')
+        fail_system(fullname, [], task['err'], manifest, params)
+        return
+    no_confs = []
+    errors = {}
+    infeasible = {}
+    for i, future in enumerate(futures):
+        has_confs, err_embed, err = future.result()
+        if err is not None:
+            errors[i] = err
+        elif not has_confs:
+            no_confs.append(i)
+            if err_embed:
+                infeasible[i] = err_embed
+    print_info(fullname, len(futures), no_confs, errors, infeasible)
+    saved = [i for i in range(len(futures)) if i not in no_confs and i not in errors]
+    if errors:
+        fail_system(fullname, saved, format_errors(errors), manifest, params)
     else:
-        Xs = X.GetStereomers(params['regime'], not params['get_enantiomers'],
-                             params['trans_cycle'], params['mer_rule'])
-    # conformers
-    for X in Xs:
-        X.AddConformers(numConfs = params['num_confs'],
-                        rmsThresh = params['rms_thresh'])
-        X.OrderConfsByEnergy()
-    # output
-    save_isomers(Xs, fullname, params)
+        finish_system(fullname, saved, manifest, params)
+    
+    return
+
+
+def run_mace_parallel(jobs, manifest, params):
+    '''Distributes stereomer search and 3D generation for all systems
+    over the pool of worker processes. Systems are consumed from the
+    iterator, and at most 4*n_jobs of them are processed at once. Output
+    files and info messages do not depend on the order in which tasks
+    are finished
+    '''
+    window = 4 * params['n_jobs']
+    tasks = deque()
+    with ProcessPoolExecutor(max_workers = params['n_jobs']) as pool:
+        for fullname, X, system_hash in jobs:
+            start_system(fullname, system_hash, manifest, params)
+            search = pool.submit(_task_isomers, X, fullname, params)
+            tasks.append({'name': fullname, 'search': search, 'futures': None, 'err': None})
+            # 3D generation as soon as stereomers of the system are found
+            _submit_ready(pool, tasks, params)
+            # collect results in the input order
+            while len(tasks) > window:
+                _collect_system(pool, tasks.popleft(), manifest, params)
+                _submit_ready(pool, tasks, params)
+        while tasks:
+            _collect_system(pool, tasks.popleft(), manifest, params)
+            _submit_ready(pool, tasks, params)
+    
+    return
+
+
+
+#%% Queue
+
+def enqueue_systems(jobs, params):
+    '''Adds stereomers of all systems to the queue. Systems already
+    present in the queue are not searched again, but their failed
+    tasks are returned to the queue
+    '''
+    queue = TaskQueue(params['queue'])
+    # parameters of 3D generation and output
+    info = {key: params[key] for key in MANIFEST_PARAMS}
+    info['out_dir'] = os.path.abspath(params['out_dir'])
+    n_tasks = 0
+    for fullname, X, system_hash in jobs:
+        # the same system saved under another name or to another
+        # directory is a different system for the queue
+        text = json.dumps([system_hash, fullname, info['out_dir']])
+        queue_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        if queue.HasSystem(queue_hash):
+            n_retry = queue.RetryFailed(queue_hash)
+            print(f'{fullname}: already queued; {n_retry} failed tasks returned to the queue')
+            n_tasks += n_retry
+            continue
+        smiles = [mace.MolToSmiles(X.mol) for X in iter_isomers(X, fullname, params)]
+        queue.AddSystem(fullname, queue_hash, info, smiles)
+        print(f'{fullname}: found {len(smiles)} isomers; queued')
+        n_tasks += len(smiles)
+    queue.Close()
+    print(f'{params["name"]}: {n_tasks} tasks added to the queue {params["queue"]}')
+    
+    return
+
+
+def run_task(task):
+    '''Generates and saves conformers of the stereomer described by the
+    queue task; returns has_confs and err_embed as _task_conformers
+    '''
+    params = task['params']
+    X = mace.ComplexFromMol(mace.MolFromSmiles(task['smiles']), params['geom'],
+                            params['res_structs'])
+    os.makedirs(os.path.join(params['out_dir'], task['name']), exist_ok = True)
+    add_conformers(X, params)
+    
+    return save_isomer(X, task['iso'], task['name'], params), X.err_embed
+
+
+def print_system_tasks(name, tasks):
+    '''Prints info message on the system which tasks are finished'''
+    no_confs = [t['iso'] for t in tasks if t['status'] == 'done' and not t['has_confs']]
+    errors = {t['iso']: t['error'] for t in tasks if t['status'] == 'failed'}
+    infeasible = {t['iso']: t['err_embed'] for t in tasks if t['err_embed']}
+    print_info(name, len(tasks), no_confs, errors, infeasible)
+    
+    return
+
+
+def run_worker(args):
+    '''Processes tasks from the queue until it is empty'''
+    # the database must not be created by the mistyped path
+    if not os.path.isfile(args.queue):
+        raise MaceInputError(f'Queue database does not exist: {args.queue}')
+    queue = TaskQueue(args.queue)
+    worker = get_worker_name()
+    n_tasks = 0
+    while args.max_tasks is None or n_tasks < args.max_tasks:
+        # systems finished by tasks which workers died on
+        for system_hash, name in queue.FailExpired(args.max_attempts):
+            print_system_tasks(name, queue.GetSystemTasks(system_hash))
+        task = queue.Claim(worker, args.lease, args.max_attempts)
+        if task is None:
+            # tasks of other workers may return to the queue
+            if not queue.GetCounts()['running']:
+                break
+            time.sleep(args.poll)
+            continue
+        n_tasks += 1
+        t0 = time.time()
+        try:
+            has_confs, err_embed = run_task(task)
+            done = queue.Finish(task, worker, has_confs, err_embed)
+            print(f'{task["name"]}: iso{task["iso"]} done in {time.time() - t0:.1f} s')
+        except Exception as e:
+            err = _error_message(e)
+            done = queue.Fail(task, worker, err, args.max_attempts)
+            print(f'{task["name"]}: iso{task["iso"]} failed (attempt {task["attempts"]})\n  {err}')
+        if done:
+            print_system_tasks(task['name'], queue.GetSystemTasks(task['hash']))
+    # summary
+    counts = queue.GetCounts()
+    queue.Close()
+    print(f'{worker}: {n_tasks} tasks processed; queue: ' + \
+          ', '.join([f'{n} {status}' for status, n in counts.items()]))
     
     return
 
@@ -503,9 +975,30 @@ def _main():
     args = read_arguments()
     params = check_arguments(args)
     # get complexes
-    jobs = prepare_complexes(params)
-    for fullname, X in jobs.items():
-        run_mace_for_system(X, fullname, params)
+    manifest = read_manifest(params)
+    dropped = []
+    jobs = iter_jobs(iter_complexes(params, dropped), manifest, params)
+    if params['queue']:
+        enqueue_systems(jobs, params)
+    elif params['n_jobs'] > 1:
+        run_mace_parallel(jobs, manifest, params)
+    else:
+        for fullname, X, system_hash in jobs:
+            start_system(fullname, system_hash, manifest, params)
+            try:
+                saved, errors = run_mace_for_system(X, fullname, params)
+            except Exception as e:
+                err = _error_message(e)
+                print(f'{fullname}: stereomer search failed\n  {err}')
+                fail_system(fullname, [], err, manifest, params)
+                continue
+            if errors:
+                fail_system(fullname, saved, format_errors(errors), manifest, params)
+            else:
+                finish_system(fullname, saved, manifest, params)
+    # repeating systems
+    if dropped:
+        print(f'{params["name"]}: {len(dropped)} repeating systems dropped')
     
     return
 
@@ -521,6 +1014,17 @@ def main():
     return
 
 
+def main_worker():
+    '''Main function of the worker processing the queue'''
+    try:
+        run_worker(get_worker_parser().parse_args())
+    except MaceInputError as e:
+        print(e)
+        sys.exit()
+    
+    return
+
+
 
 #%% Main code
 
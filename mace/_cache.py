@@ -0,0 +1,237 @@
+'''Caches for the results of expensive computations which depend on
+the molecular structure only
+'''
+
+#%% Imports
+
+from typing import Optional, Hashable
+
+import os, json, sqlite3
+from collections import OrderedDict
+
+
+#%% Cache objects
+
+class _LRUCache():
+    '''Bounded in-memory cache discarding the least recently used entries
+    
+    Arguments:
+        maxSize (int): maximal number of stored entries; if 0, nothing is stored
+    '''
+    
+    def __init__(self, maxSize = 1024):
+        '''Constructor'''
+        self.maxSize = int(maxSize)
+        if self.maxSize < 0:
+            raise ValueError('Bad cache size: must be zero or positive')
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    
+    def __len__(self):
+        '''Number of stored entries'''
+        
+        return len(self._data)
+    
+    
+    def Get(self, key):
+        '''Returns cached value or None if the key is absent
+        
+        Arguments:
+            key (Hashable): key of the entry
+        
+        Returns:
+            object: cached value or None
+        '''
+        if key not in self._data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        
+        return self._data[key]
+    
+    
+    def Set(self, key, value):
+        '''Stores the value
+        
+        Arguments:
+            key (Hashable): key of the entry;
+            value (object): value to store
+        '''
+        if not self.maxSize:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxSize:
+            self._data.popitem(last = False)
+    
+    
+    def Clear(self):
+        '''Removes all entries and resets statistics'''
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class _DiskCache():
+    '''Persistent key-value storage based on SQLite database. Keys and
+    values must be JSON-serializable
+    
+    Arguments:
+        path (str): path to the database file, created if does not exist
+    '''
+    
+    def __init__(self, path):
+        '''Constructor'''
+        self.path = path
+        self.hits = 0
+        self._conn = None
+        self._pid = None
+        self._Connect()
+    
+    
+    def _Connect(self):
+        '''Opens connection; reopens it in child processes as SQLite
+        connections must not be shared between processes
+        '''
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        self._conn = sqlite3.connect(self.path, timeout = 60)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.commit()
+        self._pid = os.getpid()
+        
+        return self._conn
+    
+    
+    def Get(self, key):
+        '''Returns cached value or None if the key is absent'''
+        row = self._Connect().execute('SELECT value FROM cache WHERE key = ?',
+                                      (json.dumps(key),)).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        
+        return json.loads(row[0])
+    
+    
+    def Set(self, key, value):
+        '''Stores the value'''
+        conn = self._Connect()
+        conn.execute('INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)',
+                     (json.dumps(key), json.dumps(value)))
+        conn.commit()
+    
+    
+    def Clear(self):
+        '''Removes all entries and resets statistics'''
+        conn = self._Connect()
+        conn.execute('DELETE FROM cache')
+        conn.commit()
+        self.hits = 0
+
+
+class _ComparisonCache():
+    '''Two-level cache of Complex._ID and Complex._eID attributes: in-memory
+    LRU cache and optional SQLite database persisting between runs
+    '''
+    
+    def __init__(self, maxSize = 1024, path = None):
+        '''Constructor'''
+        self.Setup(maxSize, path)
+    
+    
+    def Setup(self, maxSize = 1024, path = None):
+        '''Replaces both storages with the new ones'''
+        self.memory = _LRUCache(maxSize)
+        self.disk = _DiskCache(path) if path else None
+    
+    
+    def Get(self, key):
+        '''Returns (_ID, _eID) tuple of frozensets or None if the key is absent'''
+        value = self.memory.Get(key)
+        if value is not None or self.disk is None:
+            return value
+        value = self.disk.Get(list(key))
+        if value is None:
+            return None
+        value = (frozenset(value[0]), frozenset(value[1]))
+        self.memory.Set(key, value)
+        
+        return value
+    
+    
+    def Set(self, key, value):
+        '''Stores (_ID, _eID) tuple'''
+        value = (frozenset(value[0]), frozenset(value[1]))
+        self.memory.Set(key, value)
+        if self.disk is not None:
+            self.disk.Set(list(key), [sorted(value[0]), sorted(value[1])])
+
+
+_COMPARISON_CACHE = _ComparisonCache()
+
+# bounds matrixes shared by complexes with the same topology and atom order,
+# and MM parameters of ligands shared by complexes with the same topology
+_BOUNDS_CACHE = _LRUCache(256)
+_FF_TEMPLATE_CACHE = _LRUCache(256)
+
+
+#%% Functions
+
+def SetComparisonCache(maxSize = 1024, path = None):
+    '''Sets up the cache of structure descriptors used for the comparison
+    of complexes (Complex._ID and Complex._eID). The descriptors depend on
+    the canonical SMILES, geometry, and the number of resonance structures
+    only, so identical complexes met during stereomer search or substituent
+    enumeration skip their computation. Resets cache statistics
+    
+    Arguments:
+        maxSize (int): maximal number of complexes stored in memory;
+            if 0, in-memory caching is disabled;
+        path (Optional[str]): path to SQLite database used as a persistent
+            cache shared between runs and processes; if None, descriptors
+            are stored in memory only
+    '''
+    _COMPARISON_CACHE.Setup(maxSize, path)
+    
+    return
+
+
+def GetComparisonCacheInfo():
+    '''Returns statistics of the comparison cache
+    
+    Returns:
+        dict: numbers of in-memory hits ("hits"), persistent cache hits
+            ("disk_hits"), and misses ("misses"), as well as current
+            ("size") and maximal ("max_size") numbers of in-memory entries
+            and the database path ("path")
+    '''
+    cache = _COMPARISON_CACHE
+    disk_hits = cache.disk.hits if cache.disk is not None else 0
+    info = {'hits': cache.memory.hits,
+            'disk_hits': disk_hits,
+            'misses': cache.memory.misses - disk_hits,
+            'size': len(cache.memory),
+            'max_size': cache.memory.maxSize,
+            'path': cache.disk.path if cache.disk is not None else None}
+    
+    return info
+
+
+def ClearComparisonCache(persistent = False):
+    '''Clears in-memory comparison cache and resets its statistics
+    
+    Arguments:
+        persistent (bool): if True, clears the SQLite database as well
+    '''
+    _COMPARISON_CACHE.memory.Clear()
+    if _COMPARISON_CACHE.disk is not None:
+        if persistent:
+            _COMPARISON_CACHE.disk.Clear()
+        _COMPARISON_CACHE.disk.hits = 0
+    
+    return
+
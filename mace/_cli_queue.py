@@ -0,0 +1,266 @@
+'''SQLite-based queue of epic-mace tasks. The database file is the only
+shared resource, so workers running on different nodes need nothing but
+the common filesystem
+'''
+
+#%% Imports
+
+from typing import Optional, List, Tuple
+
+import os, json, time, socket, sqlite3
+from contextlib import contextmanager
+
+
+#%% Queue object
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS systems (
+    hash TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    params TEXT NOT NULL,
+    n_iso INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash TEXT NOT NULL REFERENCES systems(hash),
+    iso INTEGER NOT NULL,
+    smiles TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created REAL,
+    started REAL,
+    finished REAL,
+    elapsed REAL,
+    has_confs INTEGER,
+    err_embed TEXT,
+    error TEXT,
+    UNIQUE (hash, iso)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id);
+'''
+
+
+def get_worker_name():
+    '''Returns name of the current process unique over the cluster'''
+    
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class TaskQueue():
+    '''Queue of 3D generation tasks, one per stereomer. Tasks are claimed
+    by workers for a limited time (lease); if the worker does not report
+    the result before the lease expires, the task is returned to the queue.
+    Failed tasks are retried until the maximal number of attempts is reached.
+    
+    The default rollback journal is used since the WAL mode requires shared
+    memory and is not supported by network filesystems
+    
+    Arguments:
+        path (str): path to the database file, created if does not exist
+    '''
+    
+    def __init__(self, path):
+        '''Constructor'''
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout = 600, isolation_level = None)
+        self._conn.row_factory = sqlite3.Row
+        with self._Transaction() as conn:
+            for statement in _SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+    
+    
+    @contextmanager
+    def _Transaction(self):
+        '''Write transaction; the database is locked from its beginning,
+        so concurrent workers never claim the same task
+        '''
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+    
+    
+    def Close(self):
+        '''Closes connection to the database'''
+        self._conn.close()
+    
+    
+    def HasSystem(self, systemHash):
+        '''Checks if the system was already added to the queue'''
+        row = self._conn.execute('SELECT 1 FROM systems WHERE hash = ?',
+                                 (systemHash,)).fetchone()
+        
+        return row is not None
+    
+    
+    def AddSystem(self, name, systemHash, params, smiles):
+        '''Adds the system and its stereomers to the queue
+        
+        Arguments:
+            name (str): name of the system;
+            systemHash (str): hash of the system's SMILES, parameters, name,
+                and output directory;
+            params (dict): parameters of the job (must be JSON-serializable);
+            smiles (List[str]): SMILES of stereomers
+        '''
+        now = time.time()
+        with self._Transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO systems (hash, name, params, n_iso) VALUES (?, ?, ?, ?)',
+                         (systemHash, name, json.dumps(params), len(smiles)))
+            conn.executemany('INSERT OR IGNORE INTO tasks (hash, iso, smiles, created) VALUES (?, ?, ?, ?)',
+                             [(systemHash, i, smi, now) for i, smi in enumerate(smiles)])
+        
+        return
+    
+    
+    def RetryFailed(self, systemHash):
+        '''Returns failed tasks of the system to the queue; returns
+        the number of such tasks
+        '''
+        with self._Transaction() as conn:
+            cur = conn.execute('''UPDATE tasks SET status = 'pending', attempts = 0, error = NULL
+                                  WHERE hash = ? AND status = 'failed' ''', (systemHash,))
+        
+        return cur.rowcount
+    
+    
+    def FailExpired(self, maxAttempts = 3):
+        '''Marks tasks with the expired lease and exhausted attempts as failed
+        
+        Arguments:
+            maxAttempts (int): maximal number of attempts per task
+        
+        Returns:
+            List[Tuple[str, str]]: hashes and names of systems which tasks
+                are all finished after that
+        '''
+        now = time.time()
+        with self._Transaction() as conn:
+            rows = conn.execute('''SELECT DISTINCT tasks.hash, systems.name
+                                   FROM tasks JOIN systems ON tasks.hash = systems.hash
+                                   WHERE tasks.status = 'running' AND tasks.lease_until < ?
+                                     AND tasks.attempts >= ?''', (now, maxAttempts)).fetchall()
+            conn.execute('''UPDATE tasks SET status = 'failed', error = 'Lease expired', lease_until = NULL
+                            WHERE status = 'running' AND lease_until < ? AND attempts >= ?''',
+                         (now, maxAttempts))
+            finished = []
+            for row in rows:
+                left = conn.execute('''SELECT COUNT(*) FROM tasks
+                                       WHERE hash = ? AND status NOT IN ('done', 'failed')''',
+                                    (row[0],)).fetchone()
+                if left[0] == 0:
+                    finished.append( (row[0], row[1]) )
+        
+        return finished
+    
+    
+    def Claim(self, worker, lease = 3600.0, maxAttempts = 3):
+        '''Claims the first available task: pending or running with the
+        expired lease. Tasks with the expired lease and exhausted attempts
+        are not claimed (see FailExpired)
+        
+        Arguments:
+            worker (str): name of the worker;
+            lease (float): time in seconds for which the task is claimed;
+            maxAttempts (int): maximal number of attempts per task
+        
+        Returns:
+            Optional[dict]: task info including job parameters or None
+                if no task is available
+        '''
+        now = time.time()
+        with self._Transaction() as conn:
+            row = conn.execute('''SELECT tasks.id, tasks.hash, tasks.iso, tasks.smiles, tasks.attempts,
+                                         systems.name, systems.params, systems.n_iso
+                                  FROM tasks JOIN systems ON tasks.hash = systems.hash
+                                  WHERE tasks.status = 'pending'
+                                     OR (tasks.status = 'running' AND tasks.lease_until < ?
+                                         AND tasks.attempts < ?)
+                                  ORDER BY tasks.id LIMIT 1''', (now, maxAttempts)).fetchone()
+            if row is None:
+                return None
+            conn.execute('''UPDATE tasks SET status = 'running', attempts = attempts + 1,
+                                             worker = ?, lease_until = ?, started = ?
+                            WHERE id = ?''', (worker, now + lease, now, row['id']))
+        task = dict(row)
+        task['params'] = json.loads(task['params'])
+        task['attempts'] += 1
+        
+        return task
+    
+    
+    def _SetResult(self, task, worker, status, hasConfs, errEmbed, error):
+        '''Stores result of the task if it is still claimed by the worker;
+        returns True if it was the last unfinished task of the system
+        '''
+        now = time.time()
+        with self._Transaction() as conn:
+            cur = conn.execute('''UPDATE tasks SET status = ?, finished = ?, elapsed = ? - started,
+                                                   has_confs = ?, err_embed = ?, error = ?, lease_until = NULL
+                                  WHERE id = ? AND worker = ? AND status = 'running' ''',
+                               (status, now, now, hasConfs, errEmbed, error, task['id'], worker))
+            if not cur.rowcount:
+                return False
+            row = conn.execute('''SELECT COUNT(*) FROM tasks
+                                  WHERE hash = ? AND status NOT IN ('done', 'failed')''',
+                               (task['hash'],)).fetchone()
+        
+        return row[0] == 0
+    
+    
+    def Finish(self, task, worker, hasConfs, errEmbed = None):
+        '''Marks the task as done
+        
+        Arguments:
+            task (dict): task returned by the Claim method;
+            worker (str): name of the worker;
+            hasConfs (bool): if the stereomer has conformers;
+            errEmbed (Optional[str]): reason why conformers were not generated
+        
+        Returns:
+            bool: True if all tasks of the system are finished
+        '''
+        
+        return self._SetResult(task, worker, 'done', int(hasConfs), errEmbed, None)
+    
+    
+    def Fail(self, task, worker, error, maxAttempts = 3):
+        '''Returns the failed task to the queue or marks it as failed if
+        the maximal number of attempts is reached
+        
+        Arguments:
+            task (dict): task returned by the Claim method;
+            worker (str): name of the worker;
+            error (str): error message;
+            maxAttempts (int): maximal number of attempts per task
+        
+        Returns:
+            bool: True if all tasks of the system are finished
+        '''
+        status = 'failed' if task['attempts'] >= maxAttempts else 'pending'
+        
+        return self._SetResult(task, worker, status, None, None, error)
+    
+    
+    def GetSystemTasks(self, systemHash):
+        '''Returns info on all tasks of the system ordered by stereomer index'''
+        rows = self._conn.execute('SELECT * FROM tasks WHERE hash = ? ORDER BY iso',
+                                  (systemHash,)).fetchall()
+        
+        return [dict(row) for row in rows]
+    
+    
+    def GetCounts(self):
+        '''Returns numbers of tasks by status'''
+        rows = self._conn.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall()
+        counts = {status: 0 for status in ('pending', 'running', 'done', 'failed')}
+        counts.update({row[0]: row[1] for row in rows})
+        
+        return counts
+
@@ -1,12 +1,15 @@
 '''Contains functions for initializing the Complex object from MACE-generated
-XYZ-files
+XYZ-files and binary ensemble files
 '''
 
 #%% Imports
 
-from typing import Type
+from typing import Type, Union, Tuple, Iterator
 
-import json, os
+import json, os, mmap, struct, zipfile
+from copy import deepcopy
+
+import numpy as np
 
 from rdkit import Chem
 from rdkit.Chem import AllChem
@@ -16,151 +19,137 @@ from ._complex_init_mols import ComplexFromMol
 from ._complex_object import Complex
 
 
-#%% Functions
+#%% Parsing
 
-def _ReadXYZ(path):
-    '''Reads MACE-generated XYZ-file and prepares data for Complex initialization
+def _CheckXYZInfo(info):
+    '''Checks that the comment line of the MACE-generated XYZ block contains
+    all required fields
+    
+    Arguments:
+        info (dict): JSON-parsed comment line
+    '''
+    if 'geom' not in info:
+        raise ValueError('Bad XYZ file: second line must contain geometry of the central atom')
+    if 'smiles' not in info or 'smiles3D' not in info or 'smiles3Dx' not in info:
+        raise ValueError('Bad XYZ file: second line must contain SMILES strings of the complex')
+    if 'dummies' not in info:
+        raise ValueError('Bad XYZ file: second line must contain coordinates of dummies-helpers')
+    if len(info['dummies']) % 3:
+        raise ValueError('Bad XYZ file: bad number of dummies-helpers\' coordinates')
+    if 'E' not in info:
+        raise ValueError('Bad XYZ file: second line must contain MM energy of the complex')
+    else:
+        try:
+            float(info['E'])
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            raise ValueError('Bad XYZ file: MM energy must be float')
+    
+    return
+
+
+def _CheckXYZTopology(info0, info1):
+    '''Checks that two XYZ blocks describe the same complex
+    
+    Arguments:
+        info0 (dict): info of the first XYZ block;
+        info1 (dict): info of the other XYZ block
+    '''
+    if info0['geom'] != info1['geom']:
+        raise ValueError('Bad XYZ file: geometry must be the same for all structures')
+    if info0['smiles'] != info1['smiles'] or info0['smiles3D'] != info1['smiles3D'] or info0['smiles3Dx'] != info1['smiles3Dx']:
+        raise ValueError('Bad XYZ file: SMILES must be the same for all structures')
+    if info0['atoms'] != info1['atoms']:
+        raise ValueError('Bad XYZ file: atoms in coordinates block must be the same for all structures')
+    if len(info0['dummies']) != len(info1['dummies']):
+        raise ValueError('Bad XYZ file: number of dummies must be equivalent for all structures')
+    
+    return
+
+
+def _IterXYZBlocks(path):
+    '''Reads MACE-generated XYZ-file block by block. The file is memory-mapped,
+    so only the current block is stored in memory. Incomplete last block
+    is ignored
     
     Arguments:
         path (str): path to MACE-generated XYZ file
     
     Returns:
-        tuple containing molecules for mol, mol3D, and mol3Dx attributes,
-            and dictionary containing other parameters
+        Iterator[dict]: JSON-parsed comment lines completed with conformer
+            index ("conf"), atomic symbols ("atoms"), and coordinates
+            of shape (n_atoms, 3) ("coords")
     '''
-    # read file
     if not os.path.isfile(path):
         raise ValueError('Bad XYZ path: file does not exist')
-    with open(path, 'r') as inpf:
-        text = [_.strip() for _ in inpf.readlines()]
-    # first check and split to blocks
-    if not text[0].isdigit():
-        raise ValueError('Bad XYZ file: the first line must contain the number of atoms')
-    N = int(text[0])
-    if len(text) < N + 2:
-        raise ValueError('Bad XYZ file: number of atoms in the coordinates block is less than specified in the first line')
-    chunks = [text[i-N-1:i+1] for i in range(N + 1, len(text), N + 2)]
-    # check format
-    infos = []
-    for i, chunk in enumerate(chunks):
-        # first line format
-        if not chunk[0].isdigit():
-            raise ValueError('Bad XYZ file: the first line of a text chunk must contain the number of atoms')
-        # second line format
-        try:
-            info = json.loads(chunk[1])
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except:
-            raise ValueError('Bad XYZ file: second line must be a JSON')
-        if 'geom' not in info:
-            raise ValueError('Bad XYZ file: second line must contain geometry of the central atom')
-        if 'smiles' not in info or 'smiles3D' not in info or 'smiles3Dx' not in info:
-            raise ValueError('Bad XYZ file: second line must contain SMILES strings of the complex')
-        if 'dummies' not in info:
-            raise ValueError('Bad XYZ file: second line must contain coordinates of dummies-helpers')
-        if len(info['dummies']) % 3:
-            raise ValueError('Bad XYZ file: bad number of dummies-helpers\' coordinates')
-        if 'E' not in info:
-            raise ValueError('Bad XYZ file: second line must contain MM energy of the complex')
-        else:
-            try:
-                float(info['E'])
-            except (KeyboardInterrupt, SystemExit):
-                raise
-            except:
-                raise ValueError('Bad XYZ file: MM energy must be float')
-        info['conf'] = i
-        if 'rms' not in info:
-            info['rms'] = -1.0
-        # parse coordinates
-        try:
-            atoms = [_.split()[0] for _ in chunk[2:2+N]]
-            coords = [Point3D(*[float(_) for _ in line.split()[1:4]]) for line in chunk[2:2+N]]
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except:
-            raise ValueError('Bad XYZ file: cannot read coordinates block')
-        info['atoms'] = atoms
-        info['coords'] = coords
-        infos.append(info)
-    # check that smiles and atoms is equal everythere
-    info0 = infos[0]
-    for info1 in infos[1:]:
-        if info0['geom'] != info1['geom']:
-            raise ValueError('Bad XYZ file: geometry must be the same for all structures')
-        if info0['smiles'] != info1['smiles'] or info0['smiles3D'] != info1['smiles3D'] or info0['smiles3Dx'] != info1['smiles3Dx']:
-            raise ValueError('Bad XYZ file: SMILES must be the same for all structures')
-        if info0['atoms'] != info1['atoms']:
-            raise ValueError('Bad XYZ file: atoms in coordinates block must be the same for all structures')
-        if len(info0['dummies']) != len(info1['dummies']):
-            raise ValueError('Bad XYZ file: number of dummies must be equivalent for all structures')
-    # check molecules
-    ps = Chem.SmilesParserParams()
-    ps.removeHs = False
-    mol = Chem.MolFromSmiles(info0['smiles'], params = ps)
-    mol3D = Chem.MolFromSmiles(info0['smiles3D'], params = ps)
-    mol3Dx = Chem.MolFromSmiles(info0['smiles3Dx'], params = ps)
-    if not mol or not mol3D or not mol3Dx:
-        raise ValueError('Bad XYZ file: not readable SMILES')
-    if mol3D.GetNumAtoms() != N:
-        raise ValueError('Bad XYZ file: number of atoms in molecule and coordinates block do not match')
-    if mol3Dx.GetNumAtoms() - mol3D.GetNumAtoms() != int(len(info0['dummies'])/3):
-        raise ValueError('Bad XYZ file: bad number of atoms in mol3Dx')
-    # make mol
+    with open(path, 'rb') as inpf:
+        if not os.fstat(inpf.fileno()).st_size:
+            raise ValueError('Bad XYZ file: the first line must contain the number of atoms')
+        with mmap.mmap(inpf.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            # first check
+            line = mm.readline().strip()
+            if not line.isdigit():
+                raise ValueError('Bad XYZ file: the first line must contain the number of atoms')
+            N = int(line)
+            mm.seek(0)
+            i = 0
+            while True:
+                chunk = [mm.readline() for _ in range(N + 2)]
+                if not chunk[-1]:
+                    if not i:
+                        raise ValueError('Bad XYZ file: number of atoms in the coordinates block is less than specified in the first line')
+                    break
+                # first line format
+                if not chunk[0].strip().isdigit():
+                    raise ValueError('Bad XYZ file: the first line of a text chunk must contain the number of atoms')
+                # second line format
+                try:
+                    info = json.loads(chunk[1])
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except:
+                    raise ValueError('Bad XYZ file: second line must be a JSON')
+                _CheckXYZInfo(info)
+                info['conf'] = i
+                if 'rms' not in info:
+                    info['rms'] = -1.0
+                # parse coordinates
+                try:
+                    rows = [line.split() for line in chunk[2:]]
+                    info['atoms'] = [row[0].decode() for row in rows]
+                    info['coords'] = np.array([row[1:4] for row in rows], dtype = float).reshape(N, 3)
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except:
+                    raise ValueError('Bad XYZ file: cannot read coordinates block')
+                yield info
+                i += 1
+
+
+def _RestoreMol(mol, atoms, numAtoms, name):
+    '''Restores the initial atom order and map numbers of donor atoms
+    of the molecule read from SMILES with atom indexes as map numbers
+    
+    Arguments:
+        mol (Type[Chem.Mol]): RDKit molecule;
+        atoms (List[str]): atomic symbols from the coordinates block;
+        numAtoms (int): number of atoms in the coordinates block; atoms with
+            larger indexes must be dummies-helpers;
+        name (str): name of the SMILES for the error message
+    
+    Returns:
+        Type[Chem.Mol]: RDKit molecule
+    '''
     maps = []
     for atom in mol.GetAtoms():
         maps.append(atom.GetAtomMapNum())
         atom.SetAtomMapNum(0)
     mol = Chem.RenumberAtoms(mol, tuple(zip(*sorted([(j, i) for i, j in enumerate(maps)])))[1])
-    # check mol mapping
+    # check mapping
     flag = False
     for atom in mol.GetAtoms():
-        sym = '*' if atoms[atom.GetIdx()] == 'X' else atoms[atom.GetIdx()]
-        if atom.GetSymbol() != sym:
-            flag = True
-            break
-    if flag:
-        raise ValueError('Bad XYZ file: atom numbering in SMILES and coordinates block do not match')
-    # restore DAs in mol
-    for a in mol.GetAtoms():
-        if not a.GetIsotope():
-            continue
-        if 'DATIVE' not in [str(b.GetBondType()) for b in a.GetBonds()]:
-            continue
-        a.SetAtomMapNum(a.GetIsotope())
-    # make mol3D
-    maps3D = []
-    for atom in mol3D.GetAtoms():
-        maps3D.append(atom.GetAtomMapNum())
-        atom.SetAtomMapNum(0)
-    mol3D = Chem.RenumberAtoms(mol3D, tuple(zip(*sorted([(j, i) for i, j in enumerate(maps3D)])))[1])
-    # check mol3D mapping
-    flag = False
-    for atom in mol3D.GetAtoms():
-        sym = '*' if atoms[atom.GetIdx()] == 'X' else atoms[atom.GetIdx()]
-        if atom.GetSymbol() != sym:
-            flag = True
-            break
-    if flag:
-        raise ValueError('Bad XYZ file: atom numbering in SMILES3D and coordinates block do not match')
-    # restore DAs in mol3D
-    for a in mol3D.GetAtoms():
-        if not a.GetIsotope():
-            continue
-        if 'DATIVE' not in [str(b.GetBondType()) for b in a.GetBonds()]:
-            continue
-        a.SetAtomMapNum(a.GetIsotope())
-    # make mol3Dx
-    maps3Dx = []
-    for atom in mol3Dx.GetAtoms():
-        maps3Dx.append(atom.GetAtomMapNum())
-        atom.SetAtomMapNum(0)
-    mol3Dx = Chem.RenumberAtoms(mol3Dx, tuple(zip(*sorted([(j, i) for i, j in enumerate(maps3Dx)])))[1])
-    # check mol3Dx mapping
-    flag = False
-    for atom in mol3Dx.GetAtoms():
-        if atom.GetIdx() < mol3D.GetNumAtoms():
+        if atom.GetIdx() < numAtoms:
             sym = '*' if atoms[atom.GetIdx()] == 'X' else atoms[atom.GetIdx()]
             if atom.GetSymbol() != sym:
                 flag = True
@@ -170,34 +159,163 @@ def _ReadXYZ(path):
                 flag = True
                 break
     if flag:
-        raise ValueError('Bad XYZ file: atom numbering in SMILES3Dx and coordinates block do not match')
-    # restore DAs in mol3Dx
-    for a in mol3Dx.GetAtoms():
+        raise ValueError(f'Bad XYZ file: atom numbering in {name} and coordinates block do not match')
+    # restore DAs
+    for a in mol.GetAtoms():
         if not a.GetIsotope():
             continue
         if 'DATIVE' not in [str(b.GetBondType()) for b in a.GetBonds()]:
             continue
         a.SetAtomMapNum(a.GetIsotope())
+    
+    return mol
+
+
+def _MolsFromXYZInfo(info):
+    '''Prepares molecules for mol, mol3D, and mol3Dx attributes from
+    the topology info of the MACE-generated XYZ file
+    
+    Arguments:
+        info (dict): info of the XYZ block
+    
+    Returns:
+        tuple containing molecules for mol, mol3D, and mol3Dx attributes
+    '''
+    N = len(info['atoms'])
+    # check molecules
+    ps = Chem.SmilesParserParams()
+    ps.removeHs = False
+    mol = Chem.MolFromSmiles(info['smiles'], params = ps)
+    mol3D = Chem.MolFromSmiles(info['smiles3D'], params = ps)
+    mol3Dx = Chem.MolFromSmiles(info['smiles3Dx'], params = ps)
+    if not mol or not mol3D or not mol3Dx:
+        raise ValueError('Bad XYZ file: not readable SMILES')
+    if mol3D.GetNumAtoms() != N:
+        raise ValueError('Bad XYZ file: number of atoms in molecule and coordinates block do not match')
+    if mol3Dx.GetNumAtoms() - mol3D.GetNumAtoms() != int(len(info['dummies'])/3):
+        raise ValueError('Bad XYZ file: bad number of atoms in mol3Dx')
+    # make mols
+    mol = _RestoreMol(mol, info['atoms'], N, 'SMILES')
+    mol3D = _RestoreMol(mol3D, info['atoms'], N, 'SMILES3D')
+    mol3Dx = _RestoreMol(mol3Dx, info['atoms'], N, 'SMILES3Dx')
     # final checks
     if Chem.MolToSmiles(mol, canonical = False) != Chem.MolToSmiles(Chem.RemoveHs(mol3D), canonical = False):
         raise ValueError('Bad XYZ file: SMILES and SMILES3D do not match')
     
-    return mol, mol3D, mol3Dx, infos
+    return mol, mol3D, mol3Dx
 
 
-def ComplexFromXYZFile(path):
-    '''Reads MACE-generated XYZ-file and initializes the corresponding Complex object
+def _ReadXYZ(path):
+    '''Reads MACE-generated XYZ-file and prepares data for Complex initialization
     
     Arguments:
         path (str): path to MACE-generated XYZ file
     
+    Returns:
+        tuple containing molecules for mol, mol3D, and mol3Dx attributes,
+            and dictionary containing other parameters
+    '''
+    infos = list(_IterXYZBlocks(path))
+    for info in infos[1:]:
+        _CheckXYZTopology(infos[0], info)
+    mol, mol3D, mol3Dx = _MolsFromXYZInfo(infos[0])
+    
+    return mol, mol3D, mol3Dx, infos
+
+
+def _MemmapNpzMember(path, zinfo):
+    '''Memory-maps array stored in the uncompressed .npz archive
+    (numpy.load ignores mmap_mode for .npz files)
+    
+    Arguments:
+        path (str): path to .npz file;
+        zinfo (Type[zipfile.ZipInfo]): info on the archive member
+    
+    Returns:
+        np.ndarray: read-only memory-mapped array
+    '''
+    with open(path, 'rb') as inpf:
+        # skip local file header
+        inpf.seek(zinfo.header_offset)
+        header = inpf.read(30)
+        if header[:4] != b'PK\x03\x04':
+            raise ValueError('Bad ensemble file: broken archive')
+        n_name, n_extra = struct.unpack('<HH', header[26:30])
+        inpf.seek(zinfo.header_offset + 30 + n_name + n_extra)
+        # read npy header
+        version = np.lib.format.read_magic(inpf)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(inpf)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(inpf)
+        offset = inpf.tell()
+    if dtype.hasobject:
+        raise ValueError('Bad ensemble file: object arrays are not supported')
+    if not np.prod(shape, dtype = np.int64):
+        return np.zeros(shape, dtype = dtype)
+    
+    return np.memmap(path, dtype = dtype, mode = 'r', offset = offset, shape = shape,
+                     order = 'F' if fortran_order else 'C')
+
+
+def ReadEnsembleFile(path):
+    '''Reads binary ensemble file created by Complex.ToEnsembleFile. Arrays
+    are memory-mapped, so no data are copied until they are accessed
+    
+    Arguments:
+        path (str): path to the ensemble file
+    
+    Returns:
+        dict: topology of the complex (keys "geom", "smiles", "smiles3D",
+            "smiles3Dx", "atoms", etc.) and arrays of conformer Ids ("conf"),
+            MM energies ("E"), RMSD of the constrained part ("rms"), and
+            coordinates of mol3Dx atoms of shape (n_confs, n_atoms + n_dummies, 3)
+            ("coords")
+    '''
+    if not os.path.isfile(path):
+        raise ValueError('Bad ensemble path: file does not exist')
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise ValueError('Bad ensemble file: not a NumPy .npz archive')
+    with archive:
+        members = {zinfo.filename[:-4]: zinfo for zinfo in archive.infolist()}
+        if set(members) != {'topology', 'conf', 'E', 'rms', 'coords'}:
+            raise ValueError('Bad ensemble file: unexpected set of arrays')
+        data = {}
+        for key, zinfo in members.items():
+            if zinfo.compress_type == zipfile.ZIP_STORED:
+                data[key] = _MemmapNpzMember(path, zinfo)
+            else:
+                # compressed arrays cannot be memory-mapped
+                with archive.open(zinfo) as inpf:
+                    data[key] = np.lib.format.read_array(inpf, allow_pickle = False)
+    info = json.loads(str(data.pop('topology')[()]))
+    info.update(data)
+    if info['coords'].ndim != 3 or info['coords'].shape[1] < len(info['atoms']):
+        raise ValueError('Bad ensemble file: bad shape of coordinates array')
+    if not len(info['conf']) == len(info['E']) == len(info['rms']) == len(info['coords']):
+        raise ValueError('Bad ensemble file: number of conformers must be the same for all arrays')
+    
+    return info
+
+
+#%% Complex initialization
+
+def _ComplexFromMols(mol, mol3D, mol3Dx, geom):
+    '''Initializes complex without conformers from the prepared molecules
+    
+    Arguments:
+        mol (Type[Chem.Mol]): molecule for the mol attribute;
+        mol3D (Type[Chem.Mol]): molecule for the mol3D attribute;
+        mol3Dx (Type[Chem.Mol]): molecule for the mol3Dx attribute;
+        geom (str): molecular geometry
+    
     Returns:
         Type[Complex]: complex object
     '''
-    mol, mol3D, mol3Dx, infos = _ReadXYZ(path)
-    # make Complex
     try:
-        X = ComplexFromMol(mol, infos[0]['geom'])
+        X = ComplexFromMol(mol, geom)
     except ValueError as e:
         raise ValueError('Bad XYZ file: unsuccessful SMILES to Complex conversion: ' + e.args[0])
     except (KeyboardInterrupt, SystemExit):
@@ -211,35 +329,119 @@ def ComplexFromXYZFile(path):
     X.mol3D = mol3D
     X.mol3Dx = mol3Dx
     X._SetEmbedding()
+    
+    return X
+
+
+def _AddConfToComplex(X, coords, dummies, E, rms):
+    '''Adds conformer to mol, mol3D, and mol3Dx attributes of the complex
+    
+    Arguments:
+        X (Type[Complex]): complex object;
+        coords (np.ndarray): coordinates of mol3D atoms of shape (n_atoms, 3);
+        dummies (List[float]): flattened coordinates of dummies-helpers;
+        E (float): MM energy;
+        rms (float): RMSD of the constrained part of the complex
+    '''
+    coords = np.concatenate([np.asarray(coords, dtype = float).reshape(-1, 3),
+                             np.asarray(dummies, dtype = float).reshape(-1, 3)])
+    for name in ('mol', 'mol3D', 'mol3Dx'):
+        mol = getattr(X, name)
+        conf = AllChem.Conformer(mol.GetNumAtoms())
+        for i in range(mol.GetNumAtoms()):
+            conf.SetAtomPosition(i, Point3D(*coords[i]))
+        conf.SetDoubleProp('E', float(E))
+        conf.SetDoubleProp('EmbedRMS', float(rms))
+        mol.AddConformer(conf, assignId = True)
+    
+    return
+
+
+#%% Functions
+
+def IterXYZFile(path, asComplex = False):
+    '''Lazily reads MACE-generated XYZ-file conformer by conformer. The file
+    is memory-mapped, and the topology of the complex is validated once,
+    so huge ensembles can be processed in constant memory
+    
+    Arguments:
+        path (str): path to MACE-generated XYZ file;
+        asComplex (bool): if True, yields Complex objects containing a single
+            conformer; otherwise yields NumPy arrays with data
+    
+    Returns:
+        Iterator[Union[Tuple[np.ndarray, dict], Type[Complex]]]: if asComplex
+            is False, pairs of coordinates of shape (n_atoms, 3) and the info
+            dictionary (keys "conf", "E", "rms", "dummies", etc.); otherwise,
+            complexes
+    '''
+    info0 = None
+    for info in _IterXYZBlocks(path):
+        if info0 is None:
+            info0 = info
+            mol, mol3D, mol3Dx = _MolsFromXYZInfo(info0)
+            if asComplex:
+                X0 = _ComplexFromMols(mol, mol3D, mol3Dx, info0['geom'])
+        else:
+            _CheckXYZTopology(info0, info)
+            # atoms are the same, so keep a single copy
+            info['atoms'] = info0['atoms']
+        coords = info.pop('coords')
+        if not asComplex:
+            yield coords, info
+            continue
+        X = deepcopy(X0)
+        _AddConfToComplex(X, coords, info['dummies'], info['E'], info['rms'])
+        yield X
+
+
+def ComplexFromXYZFile(path):
+    '''Reads MACE-generated XYZ-file and initializes the corresponding Complex object
+    
+    Arguments:
+        path (str): path to MACE-generated XYZ file
+    
+    Returns:
+        Type[Complex]: complex object
+    '''
+    mol, mol3D, mol3Dx, infos = _ReadXYZ(path)
+    # make Complex
+    X = _ComplexFromMols(mol, mol3D, mol3Dx, infos[0]['geom'])
     # add conformers
     for info in infos:
-        # add coords to mol
-        conf = AllChem.Conformer()
-        for atom in X.mol.GetAtoms():
-            conf.SetAtomPosition(atom.GetIdx(), info['coords'][atom.GetIdx()])
-        conf.SetDoubleProp('E', info['E'])
-        conf.SetDoubleProp('EmbedRMS', info['rms'])
-        X.mol.AddConformer(conf, assignId = True)
-        # add mol3D and its coords
-        conf3D = AllChem.Conformer()
-        for atom in X.mol3D.GetAtoms():
-            conf3D.SetAtomPosition(atom.GetIdx(), info['coords'][atom.GetIdx()])
-        conf3D.SetDoubleProp('E', info['E'])
-        conf3D.SetDoubleProp('EmbedRMS', info['rms'])
-        X.mol3D.AddConformer(conf3D, assignId = True)
-        # add mol3Dx
-        conf3Dx = AllChem.Conformer()
-        for atom in X.mol3Dx.GetAtoms():
-            if atom.GetIdx() < X.mol3D.GetNumAtoms():
-                conf3Dx.SetAtomPosition(atom.GetIdx(), info['coords'][atom.GetIdx()])
-            else:
-                i = atom.GetIdx() - X.mol3D.GetNumAtoms()
-                p = Point3D(*info['dummies'][3*i:3*(i+1)])
-                conf3Dx.SetAtomPosition(atom.GetIdx(), p)
-        conf3Dx.SetDoubleProp('E', info['E'])
-        conf3Dx.SetDoubleProp('EmbedRMS', info['rms'])
-        X.mol3Dx.AddConformer(conf3Dx, assignId = True)
+        _AddConfToComplex(X, info['coords'], info['dummies'], info['E'], info['rms'])
     
     return X
 
 
+def ComplexFromEnsembleFile(path, confIds = None):
+    '''Reads binary ensemble file created by Complex.ToEnsembleFile
+    and initializes the corresponding Complex object
+    
+    Arguments:
+        path (str): path to the ensemble file;
+        confIds (Optional[List[int]]): indexes of conformers in the file to
+            load; if None, all conformers are loaded
+    
+    Returns:
+        Type[Complex]: complex object
+    '''
+    data = ReadEnsembleFile(path)
+    N = len(data['atoms'])
+    if not len(data['coords']):
+        raise ValueError('Bad ensemble file: file contains no conformers')
+    info = {key: data[key] for key in ('geom', 'smiles', 'smiles3D', 'smiles3Dx', 'atoms')}
+    info['dummies'] = data['coords'][0,N:].ravel().tolist()
+    try:
+        mol, mol3D, mol3Dx = _MolsFromXYZInfo(info)
+        X = _ComplexFromMols(mol, mol3D, mol3Dx, info['geom'])
+    except ValueError as e:
+        raise ValueError(str(e).replace('Bad XYZ file', 'Bad ensemble file'))
+    # add conformers
+    if confIds is None:
+        confIds = range(len(data['coords']))
+    for i in confIds:
+        coords = data['coords'][i]
+        _AddConfToComplex(X, coords[:N], coords[N:], data['E'][i], data['rms'][i])
+    
+    return X
@@ -8,6 +8,7 @@ from rdkit import Chem
 
 from ._smiles_parsing import MolFromSmiles
 from ._complex_object import Complex
+from ._stats import _NewStats
 
 
 #%% Functions
@@ -31,11 +32,14 @@ def ComplexFromMol(mol, geom, maxResonanceStructures = 1):
     if not mol or not Chem.MolToSmiles(mol):
         raise ValueError('Bad molecule: None or not RDKit Mol')
     X.mol = mol
+    X._stats = _NewStats()
     X._CheckMol()
     X._SetComparison()
     X.mol3D = Chem.AddHs(X.mol)
     X._embedding_prepared = False
     X._ff_prepared = False
+    X._ff_cache = None
+    X.err_embed = None
     
     return X
 
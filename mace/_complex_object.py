@@ -6,7 +6,7 @@ for mononuclear octahedral and square-planar metal complexes
 
 from typing import List, Union, Optional, Type
 
-import json
+import io, json
 from copy import deepcopy
 from itertools import product, combinations
 
@@ -14,12 +14,17 @@ import numpy as np
 
 from rdkit import Chem
 from rdkit.Chem import AllChem
-#from rdkit.Geometry.rdGeometry import Point3D
+from rdkit.Geometry.rdGeometry import Point3D
 import rdkit.Chem.rdDistGeom as rdDG
+from rdkit.DistanceGeometry import DoTriangleSmoothing
 
 from ._smiles_parsing import MolFromSmiles
 from ._parameters import params
-from ._supporting_functions import _CalcTHVolume, _RemoveRs
+from . import _cache
+from ._stats import _NewStats, _GetTimer, _COUNTERS, _TIMERS
+from ._rmsd import _GetCoords, _GetAtomPermutations, _CalcRMSMatrix, _CalcRMSToSet
+from ._supporting_functions import _CalcTHVolumes, _RemoveRs, _UniqueStereomers, \
+                                   _GetAutomorphisms, _PermutationParity
 
 
 #%% Complex object
@@ -46,6 +51,10 @@ class Complex():
         err_init (Optional[str]): message error corresponding for the incorrect
             values of DAs' atomic map numbers. If not None, the complex can not
             be used for 3D embedding, and stereomer search is required;
+        err_embed (Optional[str]): message error explaining why the spatial
+            arrangement of donor atoms is geometrically infeasible. It is set
+            during the first embedding attempt; if not None, conformer
+            generation is skipped;
         mol (Type[Chem.Mol]): RDKit Molecule describing complex without hydrogens.
             It is used for chemoinformatical operations (substructure search,
             generation of unique SMILES);
@@ -67,10 +76,14 @@ class Complex():
         _Geoms (dict): contains coordinates of ## 1-6 and ## 1-4 donor atoms
             for 3D embedding of OH and SP metal centers;
         _Bounds (dict): bounds matrix for OH and SP metal centers;
+        _BoundsArrays (dict): the same bounds as NumPy arrays of upper and
+            lower bounds with the map of position labels to their indexes;
         _PosVs (dict): ordered quadruplets of central and donor atoms forming
             tetrahedra with positive signed volume;
         _MinVs (dict): minimal volumes of tetrahedra formed by central and
             donor atoms, lesser values indicates non-OH/non-SP geometries;
+        _ScreenVs (dict): volumes of the same tetrahedra in embedded coordinates
+            below which conformers are rejected before the optimization;
         _EqOrs (dict): permutations of donor atoms corresponding to the same
             stereochemistry;
         _Nears (dict): pairs of donor atoms located close to each other (not
@@ -88,10 +101,19 @@ class Complex():
             for 3D embedding are available;
         _ff_prepared (bool): indicates that parameters required
             for MM computations are available;
+        _ff_cache (tuple): single-conformer copy of mol3Dx and MM force
+            field bound to it, reused for minimization of all conformers;
+        _core_cache (tuple): mol and prepared core molecules with coordinates
+            of their conformers used for the constrained embedding of other
+            complexes;
+        _stats (Optional[dict]): collected statistics (see mace.EnableStats),
+            None if they are not collected;
         
         _dummies (dict): atomic index => dummy atom (MM-helper, not substituent)
             map number;
         _coordMap (dict): atomic index of CA/DAs => atom's coordinates;
+        _topology (tuple): key of the mol3Dx topology and canonical ranks of
+            its atoms (see _GetTopology);
         _boundsMatrix (np.array): bounds matrix of the complex;
         _angle_params (list): list of DA-CA-DA angles and their MM parameters;
         _bond_params (list): list of CA-DA bonds and their MM parameters;
@@ -104,8 +126,10 @@ class Complex():
     _Syms = params.Syms
     _Geoms = params.Geoms
     _Bounds = params.Bounds
+    _BoundsArrays = params.BoundsArrays
     _PosVs = params.PosVs
     _MinVs = params.MinVs
+    _ScreenVs = params.ScreenVs
     _EqOrs = params.EqOrs
     _Nears = params.Nears
     _Angles = params.Angles
@@ -153,6 +177,20 @@ class Complex():
     
     def _SetComparison(self):
         '''Prepares _ID and _eID attributes required for their pairwise comparison'''
+        key = (Chem.MolToSmiles(self.mol), self.geom, self.maxResonanceStructures)
+        cached = _cache._COMPARISON_CACHE.Get(key)
+        if cached is None:
+            with _GetTimer(self._stats, 'comparison'):
+                cached = self._CalcComparison()
+            _cache._COMPARISON_CACHE.Set(key, cached)
+        self._ID = set(cached[0])
+        self._eID = set(cached[1])
+        
+        return
+    
+    
+    def _CalcComparison(self):
+        '''Calculates sets of SMILES used as _ID and _eID attributes'''
         mol_norm = deepcopy(self.mol)
         # fix resonance issues without ResonanceMolSupplier
         Chem.Kekulize(mol_norm, clearAromaticFlags = True)
@@ -230,8 +268,8 @@ class Complex():
                         break
                     _eID.append( Chem.CanonSmiles(Chem.MolToSmiles(m)) )
                     idx += 1
-        self._ID = set(_ID)
-        self._eID = set(_eID)
+        
+        return set(_ID), set(_eID)
     
     
     def __init__(self, smiles, geom, maxResonanceStructures = 1):
@@ -245,6 +283,8 @@ class Complex():
         if self.maxResonanceStructures < 0:
             raise ValueError('Bad maximal number of resonance structures: must be zero or positive')
         self.err_init = None
+        self.err_embed = None
+        self._stats = _NewStats()
         # check geom
         if self.geom not in self._Geoms:
             raise ValueError(f'Unknown geometry type: {self.geom}')
@@ -259,6 +299,8 @@ class Complex():
         self.mol3D = Chem.AddHs(self.mol)
         self._embedding_prepared = False
         self._ff_prepared = False
+        self._ff_cache = None
+        self._core_cache = None
     
     
     def _RaiseErrorInit(self):
@@ -425,10 +467,183 @@ class Complex():
         return restrictions
     
     
-    def GetStereomers(self, regime = 'all', dropEnantiomers = True,
-                      minTransCycle = None, merRule = True):
-        '''Generates stereomers of the complex saving stereochemistry of defined
-        stereocenters of ligands
+    def _GetDAPermutations(self, mol):
+        '''Finds permutations of donor atoms induced by automorphisms
+        of the molecule with unlabeled donor atoms
+        
+        Arguments:
+            mol (Type[Chem.Mol]): molecule with the same atom order as self.mol
+        
+        Returns:
+            List[Tuple[int]]: permutations of positions of donor atoms in the
+                list(self._DAs.keys()) list
+        '''
+        mol = Chem.Mol(mol)
+        for a in mol.GetAtoms():
+            if a.GetAtomMapNum():
+                a.SetAtomMapNum(0)
+                a.SetIsotope(0)
+        DAs = list(self._DAs.keys())
+        pos = {idx: k for k, idx in enumerate(DAs)}
+        perms = set()
+        for match in _GetAutomorphisms(mol):
+            perms.add(tuple([pos[match[idx]] for idx in DAs]))
+        
+        return sorted(perms)
+    
+    
+    def _GetOrbitKey(self, nums, perms):
+        '''Returns canonical representative of the orbit of DA arrangement under
+        rotations of the coordination polyhedron and permutations of equivalent
+        donor atoms. Arrangements with equal keys correspond to the same stereomer
+        
+        Arguments:
+            nums (List[int]): positions of donor atoms;
+            perms (List[Tuple[int]]): permutations of donor atoms
+        
+        Returns:
+            Tuple[int]: key of the orbit
+        '''
+        EqOrs = self._EqOrs[self.geom]
+        key = None
+        for perm in perms:
+            permuted = [0]*len(nums)
+            for k, p in enumerate(perm):
+                permuted[p] = nums[k]
+            for i in range(len(EqOrs[1])):
+                addend = tuple([EqOrs[num][i] for num in permuted])
+                if key is None or addend < key:
+                    key = addend
+        
+        return key
+    
+    
+    def _GetStereocenterTransforms(self, mol, idxs):
+        '''Finds how automorphisms of the molecule transform configurations of
+        the given undefined stereocenters. Each automorphism moves configuration
+        of the k-th stereocenter to the perm[k]-th one and inverts it if flips[k]
+        is 1 (odd permutation of neighbors)
+        
+        Arguments:
+            mol (Type[Chem.Mol]): molecule;
+            idxs (List[int]): indexes of undefined stereocenters
+        
+        Returns:
+            List[Tuple[List[int], List[int]]]: pairs of perm and flips lists
+        '''
+        pos = {idx: k for k, idx in enumerate(idxs)}
+        nbrs = lambda idx: [b.GetOtherAtomIdx(idx) for b in mol.GetAtomWithIdx(idx).GetBonds()]
+        transforms = set()
+        for match in _GetAutomorphisms(mol):
+            if any([match[idx] not in pos for idx in idxs]):
+                continue
+            perm = []
+            flips = []
+            for idx in idxs:
+                ns = nbrs(match[idx])
+                perm.append(pos[match[idx]])
+                flips.append(_PermutationParity([ns.index(match[n]) for n in nbrs(idx)]))
+            transforms.add( (tuple(perm), tuple(flips)) )
+        transforms.discard( (tuple(range(len(idxs))), (0,)*len(idxs)) )
+        
+        return sorted(transforms)
+    
+    
+    def _IterLigandConfigs(self, mol):
+        '''Yields molecules with all combinations of configurations of
+        undefined stereocenters of ligands (repeats are skipped)
+        
+        Arguments:
+            mol (Type[Chem.Mol]): molecule with the same atom order as self.mol
+        
+        Returns:
+            Iterator[Type[Chem.Mol]]: molecules with defined stereocenters
+        '''
+        idxs = [idx for idx, chi in Chem.FindMolChiralCenters(mol, includeUnassigned = True) if chi == '?']
+        idxs = [idx for idx in idxs if idx != self._idx_CA]
+        # drop P/As with nH > 2 # HINT: remove after fixing RDKit #3773
+        drop = []
+        for idx in idxs:
+            a = mol.GetAtomWithIdx(idx)
+            if a.GetSymbol() not in ('P', 'As'):
+                continue
+            nHs = a.GetNumExplicitHs() + len([_ for _ in a.GetNeighbors() if _.GetSymbol() == 'H'])
+            nXs = len([_ for _ in a.GetNeighbors() if _.GetSymbol() == '*'])
+            if nHs + nXs >= 2:
+                drop.append(idx)
+        idxs = [_ for _ in idxs if _ not in drop]
+        # generate all possible combinations of stereocentres & drop similar ones
+        CHIs = [Chem.ChiralType.CHI_TETRAHEDRAL_CCW, Chem.ChiralType.CHI_TETRAHEDRAL_CW]
+        transforms = self._GetStereocenterTransforms(mol, idxs)
+        keys = set()
+        smiles = set()
+        for chis in product([0, 1], repeat = len(idxs)):
+            # skip assignments equivalent by symmetry to earlier ones
+            key = chis
+            for perm, flips in transforms:
+                addend = [0]*len(idxs)
+                for k, (p, f) in enumerate(zip(perm, flips)):
+                    addend[p] = chis[k] ^ f
+                key = min(key, tuple(addend))
+            if key in keys:
+                continue
+            keys.add(key)
+            # set stereo
+            m = Chem.Mol(mol)
+            for idx, chi in zip(idxs, chis):
+                m.GetAtomWithIdx(idx).SetChiralTag(CHIs[chi])
+            smi = Chem.MolToSmiles(m)
+            if smi in smiles:
+                continue
+            smiles.add(smi)
+            yield m
+    
+    
+    def _IterCAArrangements(self, mols, pairs, mers):
+        '''Yields complexes with all possible arrangements of donor atoms
+        around the central atom, one per orbit of equivalent arrangements
+        
+        Arguments:
+            mols (Iterable[Type[Chem.Mol]]): molecules with the same atom
+                order as self.mol;
+            pairs (list): pairs of DAs which can not be in trans- position;
+            mers (list): pairs of DAs which must be in trans- position
+        
+        Returns:
+            Iterator[Type[Complex]]: complexes
+        '''
+        DAs = list(self._DAs.keys())
+        for m in mols:
+            perms = self._GetDAPermutations(m)
+            keys = set()
+            for idx_sym in sorted(list(self._Syms[self.geom].keys())):
+                sym = self._Syms[self.geom][idx_sym]
+                nums = [sym.index(idx + 1) + 1 for idx in range(len(DAs))]
+                info = dict(zip(DAs, nums))
+                # check neighboring DAs restriction
+                if any([info[idx_b] not in self._Nears[self.geom][info[idx_a]] for idx_a, idx_b in pairs]):
+                    continue
+                # check mer DAs restriction
+                if any([info[idx_b] in self._Nears[self.geom][info[idx_a]] for idx_a, idx_b in mers]):
+                    continue
+                # skip arrangements equivalent to earlier ones
+                key = self._GetOrbitKey(nums, perms)
+                if key in keys:
+                    continue
+                keys.add(key)
+                # set new isotopes
+                m1 = Chem.Mol(m)
+                for a_idx, num in info.items():
+                    m1.GetAtomWithIdx(a_idx).SetAtomMapNum(num)
+                    m1.GetAtomWithIdx(a_idx).SetIsotope(num)
+                yield Complex(Chem.MolToSmiles(m1), self.geom, self.maxResonanceStructures)
+    
+    
+    def IterStereomers(self, regime = 'all', dropEnantiomers = True,
+                       minTransCycle = None, merRule = True):
+        '''Lazy version of GetStereomers: yields stereomers as soon as they
+        are found to differ from the earlier yielded ones. Only SMILES-based
+        descriptors of yielded stereomers are stored
         
         Arguments:
             regime (str): which stereocenters are considered:
@@ -446,7 +661,7 @@ class Complex():
                 rigid X-Y-Z fragments (for which fac- geometry is "impossible")
         
         Returns:
-            List[Type[Complex]]: list of found stereomers prepared for 3D embedding
+            Iterator[Type[Complex]]: found stereomers prepared for 3D embedding
         '''
         if regime not in ('CA', 'ligands', 'all'):
             raise ValueError('Regime variable bad value: must be one of "CA", "ligands", "all"')
@@ -465,121 +680,124 @@ class Complex():
                 mol.GetAtomWithIdx(idx).SetAtomMapNum(num + 1)
                 mol.GetAtomWithIdx(idx).SetIsotope(num + 1)
         # generate needed stereomers
-        if regime == 'CA':
-            mols = [mol]
-        else:
-            idxs = [idx for idx, chi in Chem.FindMolChiralCenters(mol, includeUnassigned = True) if chi == '?']
-            idxs = [idx for idx in idxs if idx != self._idx_CA]
-            # drop P/As with nH > 2 # HINT: remove after fixing RDKit #3773
-            drop = []
-            for idx in idxs:
-                a = mol.GetAtomWithIdx(idx)
-                if a.GetSymbol() not in ('P', 'As'):
-                    continue
-                nHs = a.GetNumExplicitHs() + len([_ for _ in a.GetNeighbors() if _.GetSymbol() == 'H'])
-                nXs = len([_ for _ in a.GetNeighbors() if _.GetSymbol() == '*'])
-                if nHs + nXs >= 2:
-                    drop.append(idx)
-            idxs = [_ for _ in idxs if _ not in drop]
-            # generate all possible combinations of stereocentres
-            mols = []
-            for chis in product([Chem.ChiralType.CHI_TETRAHEDRAL_CCW, Chem.ChiralType.CHI_TETRAHEDRAL_CW], repeat = len(idxs)):
-                m = deepcopy(mol)
-                for idx, chi in zip(idxs, chis):
-                    m.GetAtomWithIdx(idx).SetChiralTag(chi)
-                mols.append(m)
-            # drop similar ones
-            smiles = [Chem.MolToSmiles(m) for m in mols]
-            drop = []
-            for i in range(len(smiles)-1):
-                if i in drop:
-                    continue
-                for j in range(i+1, len(smiles)):
-                    if smiles[i] == smiles[j]:
-                        drop.append(j)
-            mols = [m for i, m in enumerate(mols) if i not in drop]
-        # generate all CA isomers
+        mols = [mol] if regime == 'CA' else self._IterLigandConfigs(mol)
         if regime == 'ligands':
-            # transform mols to Complex objects
-            stereomers = []
-            for m in mols:
-                stereomers.append( Complex(Chem.MolToSmiles(m), self.geom, self.maxResonanceStructures) )
-            # filter enantiomers
-            drop = []
-            for i in range(len(stereomers)-1):
-                if i in drop:
-                    continue
-                for j in range(i+1, len(stereomers)):
-                    if stereomers[i].IsEqual(stereomers[j]):
-                        drop.append(j)
-                    elif dropEnantiomers and stereomers[i].IsEnantiomer(stereomers[j]):
-                        drop.append(j)
-            stereomers = [compl for i, compl in enumerate(stereomers) if i not in drop]
-            # return them
-            return stereomers
-        # find restrictions on DA positions
-        pairs = self._FindNeighboringDAs(minTransCycle)
-        mers = self._FindMerOnly() if merRule else []
-        # generate all possible CA orientations
-        stereomers = []
-        for m in mols:
-            addend = []
-            for idx_sym in sorted(list(self._Syms[self.geom].keys())):
-                sym = self._Syms[self.geom][idx_sym]
-                m1 = deepcopy(m)
-                # set new isotopes
-                info = {}
-                for idx, a_idx in enumerate(DAs):
-                    num = sym.index(idx + 1) + 1
-                    m1.GetAtomWithIdx(a_idx).SetAtomMapNum(num)
-                    m1.GetAtomWithIdx(a_idx).SetIsotope(num)
-                    info[a_idx] = num
-                # check neighboring DAs restriction
-                drop = False
-                for idx_a, idx_b in pairs:
-                    if info[idx_b] not in self._Nears[self.geom][info[idx_a]]:
-                        drop = True
-                if drop:
-                    continue
-                # check mer DAs restriction
-                drop = False
-                for idx_a, idx_b in mers:
-                    if info[idx_b] in self._Nears[self.geom][info[idx_a]]:
-                        drop = True
-                if drop:
-                    continue
-                addend.append(m1)
-            addend = [Complex(Chem.MolToSmiles(m), self.geom, self.maxResonanceStructures) for m in addend]
-            # filter uniques
-            drop = []
-            for i in range(len(addend)-1):
-                if i in drop:
-                    continue
-                for j in range(i+1, len(addend)):
-                    if addend[i].IsEqual(addend[j]):
-                        drop.append(j)
-            addend = [compl for i, compl in enumerate(addend) if i not in drop]
-            # add to main
-            stereomers += addend
-        # final filtering
-        drop = []
-        for i in range(len(stereomers)-1):
-            if i in drop:
-                continue
-            for j in range(i+1, len(stereomers)):
-                if stereomers[i].IsEqual(stereomers[j]):
-                    drop.append(j)
-                elif dropEnantiomers and stereomers[i].IsEnantiomer(stereomers[j]):
-                    drop.append(j)
-        stereomers = [compl for i, compl in enumerate(stereomers) if i not in drop]
+            stereomers = (Complex(Chem.MolToSmiles(m), self.geom, self.maxResonanceStructures) for m in mols)
+        else:
+            # find restrictions on DA positions
+            pairs = self._FindNeighboringDAs(minTransCycle)
+            mers = self._FindMerOnly() if merRule else []
+            stereomers = self._IterCAArrangements(mols, pairs, mers)
         
-        return stereomers    
+        # filter repeats and enantiomers
+        if self._stats is None:
+            return _UniqueStereomers(stereomers, dropEnantiomers)
+        stereomers = self._CountStereomers(stereomers, 'stereomer_candidates')
+        
+        return self._CountStereomers(_UniqueStereomers(stereomers, dropEnantiomers),
+                                     'stereomers', 'stereomers')
+    
+    
+    def GetStereomers(self, regime = 'all', dropEnantiomers = True,
+                      minTransCycle = None, merRule = True):
+        '''Generates stereomers of the complex saving stereochemistry of defined
+        stereocenters of ligands
+        
+        Arguments:
+            regime (str): which stereocenters are considered:
+              
+              - "CA": changes stereochemistry of center atom only;
+              - "ligands": changes stereochemistry of undefined stereocenters in ligands only;
+              - "all": changes both stereochemistry of CA and ligands;
+            
+            dropEnantiomers (bool): if True, leaves only one enantiomer
+                out of two in the output;
+            minTransCycle (Optional[int]): minimal size of the chelate cycle
+                required to form trans DA-CA-DA fragment. If None, trans-
+                DA-CA-DA arrangements is banned;
+            merRule (bool): if True, applies the empiric rule restricting
+                rigid X-Y-Z fragments (for which fac- geometry is "impossible")
+        
+        Returns:
+            List[Type[Complex]]: list of found stereomers prepared for 3D embedding
+        '''
+        
+        return list(self.IterStereomers(regime, dropEnantiomers, minTransCycle, merRule))
+    
+    
+#%% Statistics
+    
+    def _Count(self, key, value = 1):
+        '''Increments the counter if statistics are collected'''
+        if self._stats is not None:
+            self._stats[key] = self._stats.get(key, 0) + value
+    
+    
+    def _CountStereomers(self, stereomers, key, timer = None):
+        '''Yields stereomers counting them; if timer is specified, time
+        spent on their search is added to the statistics
+        '''
+        stereomers = iter(stereomers)
+        while True:
+            with _GetTimer(self._stats if timer else None, timer):
+                X = next(stereomers, None)
+            if X is None:
+                return
+            self._Count(key)
+            yield X
+    
+    
+    def GetStats(self):
+        '''Returns statistics collected since the creation of the complex
+        or the last ResetStats call (see mace.EnableStats). Statistics of
+        stereomers found by IterStereomers and GetStereomers are stored
+        in the corresponding complexes
+        
+        Returns:
+            dict: numbers of stereomer candidates ("stereomer_candidates")
+                and unique stereomers ("stereomers"), embedding attempts
+                ("embed_attempts") and failures ("embed_failures"), conformers
+                with wrong stereochemistry of the central atom rejected before
+                ("stereo_screened") and after ("stereo_rejections") the
+                optimization, minimizations ("minimizations") and
+                non-converged ones ("minimize_not_converged"), conformers
+                discarded by the funnel mode of AddConformers
+                ("funnel_discarded"), as well as time
+                in seconds spent on calculation of descriptors for comparison
+                ("time_comparison"), stereomer search ("time_stereomers"),
+                preparation of the bounds matrix ("time_embedding_setup"),
+                embedding ("time_embed"), setting force field ("time_ff_setup"),
+                and minimization ("time_minimize"). Empty dict is returned
+                if statistics are not collected
+        '''
+        if self._stats is None:
+            return {}
+        stats = {key: 0 for key in _COUNTERS}
+        stats.update({f'time_{key}': 0.0 for key in _TIMERS})
+        stats.update(self._stats)
+        
+        return stats
+    
+    
+    def ResetStats(self):
+        '''Clears statistics of the complex; they are collected further
+        if enabled by mace.EnableStats
+        '''
+        self._stats = _NewStats()
+        
+        return
     
     
 #%% 3D Generation
     
     def _SetEmbedding(self):
         '''Prepares attributes required for 3D embedding'''
+        with _GetTimer(self._stats, 'embedding_setup'):
+            self._PrepareEmbedding()
+    
+    
+    def _PrepareEmbedding(self):
+        '''Sets dummies, coordMap, and bounds matrix (see _SetEmbedding)'''
         # find dummies-helpers
         add = [idx for idx in self._Geoms[self.geom] if 'X' in str(idx)]
         must = set([idx for idx in self._Geoms[self.geom] if str(idx).isdigit()])
@@ -599,19 +817,84 @@ class Complex():
             self._coordMap[idx] = self._Geoms[self.geom][num]
         self.mol3Dx = ed.GetMol()
         Chem.SanitizeMol(self.mol3Dx)
-        # prepare bounds matrix
-        X = rdDG.GetMoleculeBoundsMatrix(self.mol3Dx)
+        # prepare bounds matrix: RDKit bounds depend on the order of atoms
+        # and bonds, so they are shared only by stereomers with the same order
+        self._topology = self._GetTopology()
+        key, ranks = self._topology
+        order = tuple( (int(ranks[b.GetBeginAtomIdx()]), int(ranks[b.GetEndAtomIdx()])) \
+                       for b in self.mol3Dx.GetBonds() )
+        key = (key, tuple(int(_) for _ in ranks), order)
+        X = _cache._BOUNDS_CACHE.Get(key)
+        if X is None:
+            X = rdDG.GetMoleculeBoundsMatrix(self.mol3Dx)
+            _cache._BOUNDS_CACHE.Set(key, X)
+        X = X.copy()
+        # CA & DAs
+        labs, upper, lower = self._BoundsArrays[self.geom]
         CS = [(self._idx_CA, 'CA')] + list(self._DAs.items()) + list(self._dummies.items())
-        for (i, num1), (j, num2) in combinations(CS, r = 2):
-            dmax = self._Bounds[self.geom][num1][num2]
-            dmin = self._Bounds[self.geom][num2][num1]
-            X[min(i,j)][max(i,j)] = max(dmin, dmax)
-            X[max(i,j)][min(i,j)] = min(dmin, dmax)
+        idxs = np.array([idx for idx, _ in CS])
+        nums = np.array([labs[num] for _, num in CS])
+        block = np.ix_(nums, nums)
+        X[np.ix_(idxs, idxs)] = np.where(idxs[:,None] < idxs[None,:], upper[block], lower[block])
         self._boundsMatrix = X
         # final
+        self.err_embed = self._CheckBoundsMatrix()
         self._embedding_prepared = True
     
     
+    def _GetTopology(self):
+        '''Returns the key describing the topology of mol3Dx regardless of
+        the spatial arrangement of donor atoms, chirality, and atom order,
+        and canonical ranks of atoms. Complexes with the same key (e.g.
+        stereomers of the same complex) share MM parameters of the ligands,
+        which are stored in the canonical atom order. The key contains the
+        whole graph in the canonical order, so equal keys guarantee that
+        the ranks define an isomorphism
+        
+        Returns:
+            Tuple[tuple, np.ndarray]: hashable key, and ranks of atoms
+        '''
+        mol = Chem.Mol(self.mol3Dx)
+        # isotopes of donor atoms label their positions
+        for a in mol.GetAtoms():
+            a.SetAtomMapNum(0)
+            a.SetIsotope(0)
+            a.SetChiralTag(Chem.ChiralType.CHI_UNSPECIFIED)
+        # helper dummies differ from dummies in free positions
+        for idx, num in self._dummies.items():
+            if 'X' in str(num):
+                mol.GetAtomWithIdx(idx).SetIsotope(1)
+        ranks = np.array(list(Chem.CanonicalRankAtoms(mol, breakTies = True)))
+        atoms = [None] * len(ranks)
+        for a in mol.GetAtoms():
+            atoms[ranks[a.GetIdx()]] = (a.GetAtomicNum(), a.GetFormalCharge(), a.GetIsotope(),
+                                        str(a.GetHybridization()))
+        bonds = []
+        for b in mol.GetBonds():
+            i, j = sorted([ranks[b.GetBeginAtomIdx()], ranks[b.GetEndAtomIdx()]])
+            stereo = tuple([ranks[_] for _ in b.GetStereoAtoms()])
+            bonds.append( (int(i), int(j), str(b.GetBondType()), str(b.GetStereo()), stereo) )
+        key = (tuple(atoms), tuple(sorted(bonds)), int(ranks[self._idx_CA]))
+        
+        return key, ranks
+    
+    
+    def _CheckBoundsMatrix(self):
+        '''Cheap feasibility check of the bounds matrix performed before
+        the 3D embedding. The bounds matrix must be smoothable using the
+        triangle inequality, which fails for contradictory bounds, e.g.
+        for small chelate rings spanning trans-positions. Stereomers
+        failing the check can never be embedded
+        
+        Returns:
+            Optional[str]: reason of infeasibility, None if the check passed
+        '''
+        if not DoTriangleSmoothing(self._boundsMatrix.copy()):
+            return 'Infeasible geometry: bounds matrix violates triangle inequality'
+        
+        return None
+    
+    
     def _SetCentralAtomAngles(self):
         '''Sets MM parameters of L->X<-L angles'''
         DAs = list(self._DAs.items()) + list(self._dummies.items())
@@ -625,7 +908,6 @@ class Complex():
                 k = self._FFParams['kE-LXL']
             constraint = [a1_idx, self._idx_CA, a2_idx, False, angle, angle, k]
             self._angle_params.append(constraint)
-            self._ff.UFFAddAngleConstraint(*constraint)
     
     
     def _SetCentralAtomBonds(self):
@@ -635,19 +917,16 @@ class Complex():
                    self._Rcov[self.mol3Dx.GetAtomWithIdx(idx).GetAtomicNum()]
             constraint = [idx, self._idx_CA, False, dist, dist, self._FFParams['kXL']]
             self._bond_params.append(constraint)
-            self._ff.UFFAddDistanceConstraint(*constraint)
         # dummies-helpers
         for idx, num in self._dummies.items():
             if 'X' in str(num):
                 constraint = [idx, self._idx_CA, False, self._FFParams['X*'], self._FFParams['X*'], self._FFParams['kX*']]
                 self._bond_params.append(constraint)
-                self._ff.UFFAddDistanceConstraint(*constraint)
             else:
                 dist = self._Rcov[self.mol3Dx.GetAtomWithIdx(self._idx_CA).GetAtomicNum()] + \
                        self._Rcov[self.mol3Dx.GetAtomWithIdx(idx).GetAtomicNum()]
                 constraint = [idx, self._idx_CA, False, dist, dist, self._FFParams['kXL']]
                 self._bond_params.append(constraint)
-                self._ff.UFFAddDistanceConstraint(*constraint)
     
     
     def _SetDonorAtomsAngles(self):
@@ -670,7 +949,6 @@ class Complex():
             for n in ns:
                 constraint = [self._idx_CA, DA, n, False, angle, angle, k]
                 self._angle_params.append(constraint)
-                self._ff.UFFAddAngleConstraint(*constraint)
     
     
     def _SetDonorAtomsParams(self):
@@ -688,7 +966,6 @@ class Complex():
                     self._Rcov[self.mol3Dx.GetAtomWithIdx(DA).GetAtomicNum()]
                 constraint = [DA, n, False, d, d, self._FFParams['kLA']]
                 self._bond_params.append(constraint)
-                self._ff.UFFAddDistanceConstraint(*constraint)
             # X<-L-A angles
             if N < 2 or N > 3:
                 continue
@@ -696,7 +973,6 @@ class Complex():
                 a = self._FFParams['XLA2'] if N == 2 else self._FFParams['XLA3']
                 constraint = [n1, DA, n2, False, a, a, self._FFParams['kALA']]
                 self._angle_params.append(constraint)
-                self._ff.UFFAddAngleConstraint(*constraint)
             # L-A-B angles
             for n in ns:
                 atom = self.mol3Dx.GetAtomWithIdx(n)
@@ -709,12 +985,10 @@ class Complex():
                         a = self._FFParams['XLA2']
                         constraint = [n21, n, n22, False, a, a, self._FFParams['kALA']]
                         self._angle_params.append(constraint)
-                        self._ff.UFFAddAngleConstraint(*constraint)
                     elif str(atom.GetHybridization()) == 'SP3':
                         a = self._FFParams['XLA3']
                         constraint = [n21, n, n22, False, a, a, self._FFParams['kALA']]
                         self._angle_params.append(constraint)
-                        self._ff.UFFAddAngleConstraint(*constraint)
     
     
     def _SetDummiesBonds(self):
@@ -734,85 +1008,232 @@ class Complex():
                 d = self._Rcov[n.GetAtomicNum()] + self._Rcov[a.GetAtomicNum()]
                 constraint = [a.GetIdx(), n.GetIdx(), False, d, d, self._FFParams['kA*']]
                 self._bond_params.append(constraint)
-                self._ff.UFFAddDistanceConstraint(*constraint)
     
     
-    def _SetForceField(self, confId):
-        '''Sets MM force field for the given conformer
+    def _SetForceFieldParams(self):
+        '''Prepares MM parameters. Parameters of the ligands are taken from
+        the cache shared by complexes with the same topology (e.g. stereomers),
+        so only L->X<-L angles are computed for each complex
+        '''
+        key, ranks = self._topology
+        template = _cache._FF_TEMPLATE_CACHE.Get(key)
+        if template is None:
+            self._angle_params = []
+            self._bond_params = []
+            self._SetCentralAtomBonds()
+            self._SetDonorAtomsAngles()
+            self._SetDonorAtomsParams()
+            self._SetDummiesBonds()
+            # atom indexes are stored as canonical ranks
+            template = ( tuple(tuple([int(ranks[_]) for _ in c[:3]] + list(c[3:])) for c in self._angle_params),
+                         tuple(tuple([int(ranks[_]) for _ in c[:2]] + list(c[2:])) for c in self._bond_params) )
+            _cache._FF_TEMPLATE_CACHE.Set(key, template)
+        # angles depending on the spatial arrangement of donor atoms
+        self._angle_params = []
+        self._SetCentralAtomAngles()
+        # constraints are normalized and sorted, so their order does not
+        # depend on the complex which filled the cache
+        order = [int(_) for _ in np.argsort(ranks)]
+        angles, bonds = [], []
+        for c in template[0]:
+            i, j, k = [order[_] for _ in c[:3]]
+            angles.append( [min(i, k), j, max(i, k)] + list(c[3:]) )
+        for c in template[1]:
+            bonds.append( sorted([order[_] for _ in c[:2]]) + list(c[2:]) )
+        self._angle_params += sorted(angles)
+        self._bond_params = sorted(bonds)
+        self._ff_prepared = True
+    
+    
+    def _SetForceField(self, confId, mol = None):
+        '''Sets new MM force field for the given conformer
         
         Arguments:
-            confId (int): index of the conformer
+            confId (int): index of the conformer;
+            mol (Optional[Type[Chem.Mol]]): molecule with the same atoms as
+                mol3Dx containing the conformer; if None, mol3Dx is used
         '''
-        self._ff = AllChem.UFFGetMoleculeForceField(self.mol3Dx, confId = confId)
-        if self._ff_prepared:
-            # restore them from saved params
+        if mol is None:
+            mol = self.mol3Dx
+        with _GetTimer(self._stats, 'ff_setup'):
+            if not self._ff_prepared:
+                self._SetForceFieldParams()
+            self._ff = AllChem.UFFGetMoleculeForceField(mol, confId = confId)
             for constraint in self._angle_params:
                 self._ff.UFFAddAngleConstraint(*constraint)
             for constraint in self._bond_params:
                 self._ff.UFFAddDistanceConstraint(*constraint)
-            return
-        # set ff parameters
-        self._angle_params = []
-        self._bond_params = []
-        self._SetCentralAtomAngles()
-        self._SetCentralAtomBonds()
-        self._SetDonorAtomsAngles()
-        self._SetDonorAtomsParams()
-        self._SetDummiesBonds()
-        self._ff_prepared = True
     
     
-    def _CheckStereoCA(self, confId):
-        '''Checks that generated coordinates corresponds to the given chirality
-        using signed volumes of CA-fac-(DA)3 tetrahedra
+    def _MinimizeConformer(self, confId, maxIts = 1000, mol = None,
+                           forceTol = 1e-4, energyTol = 1e-6):
+        '''Minimizes MM energy of the conformer. The force field is built
+        once for the complex using the single-conformer copy of mol3Dx,
+        and coordinates of conformers are swapped in and out of it
         
         Arguments:
-            confId (int): index of the conformer
+            confId (int): index of the conformer;
+            maxIts (int): maximal number of optimization steps;
+            mol (Optional[Type[Chem.Mol]]): molecule with the same atoms as
+                mol3Dx containing the conformer; if None, mol3Dx is used;
+            forceTol (float): convergence criterion on forces;
+            energyTol (float): convergence criterion on energy
         
         Returns:
-            bool: True if total signed volume exceeds the cut-off value,
-                False otherwise
+            Tuple[int, float]: 0 if the minimization converged, and MM energy
+        '''
+        if mol is None:
+            mol = self.mol3Dx
+        if self._ff_cache is None:
+            # HINT: all atom pairs are within the vdW cut-off for zero coordinates
+            scratch = Chem.Mol(self.mol3Dx)
+            scratch.RemoveAllConformers()
+            scratch.AddConformer(Chem.Conformer(scratch.GetNumAtoms()), assignId = True)
+            self._SetForceField(0, scratch)
+            self._ff_cache = (scratch, self._ff)
+        scratch, self._ff = self._ff_cache
+        conf = mol.GetConformer(confId)
+        work = scratch.GetConformer()
+        N = scratch.GetNumAtoms()
+        for idx in range(N):
+            work.SetAtomPosition(idx, conf.GetAtomPosition(idx))
+        with _GetTimer(self._stats, 'minimize'):
+            self._ff.Initialize()
+            flag = self._ff.Minimize(maxIts = maxIts, forceTol = forceTol,
+                                     energyTol = energyTol)
+        self._Count('minimizations')
+        self._Count('minimize_not_converged', int(flag != 0))
+        for idx in range(N):
+            conf.SetAtomPosition(idx, work.GetAtomPosition(idx))
+        
+        return flag, self._ff.CalcEnergy()
+    
+    
+    def _GetStereoCAIdxs(self):
+        '''Returns indexes of atoms forming CA-fac-(DA)3 tetrahedra
+        
+        Returns:
+            np.ndarray: array of shape (n_tetrahedra, 4)
         '''
-        conf = self.mol3Dx.GetConformer(confId)
         DAs = {val: key for key, val in self._DAs.items()}
         DAs['CA'] = self._idx_CA
         for key, val in self._dummies.items():
             DAs[val] = key
-        Vs = []
-        for idxs in self._PosVs[self.geom]:
-            Vs.append(_CalcTHVolume(conf, [DAs[idx] for idx in idxs]))
         
-        return sum(Vs) > self._MinVs[self.geom] # sum(Vs) > 0
+        return np.array([[DAs[idx] for idx in idxs] for idxs in self._PosVs[self.geom]])
+    
+    
+    def _CheckStereoCA(self, confId, mol = None):
+        '''Checks that generated coordinates corresponds to the given chirality
+        using signed volumes of CA-fac-(DA)3 tetrahedra
+        
+        Arguments:
+            confId (int): index of the conformer;
+            mol (Optional[Type[Chem.Mol]]): molecule with the same atoms as
+                mol3Dx containing the conformer; if None, mol3Dx is used
+        
+        Returns:
+            bool: True if total signed volume exceeds the cut-off value,
+                False otherwise
+        '''
+        if mol is None:
+            mol = self.mol3Dx
+        
+        return self._CheckStereoCAs(mol, [confId])[0]
+    
+    
+    def _CheckStereoCAs(self, mol, confIds):
+        '''Vectorized version of _CheckStereoCA checking the stack of conformers
+        at once. Conformers with non-finite coordinates are rejected as well
+        
+        Arguments:
+            mol (Type[Chem.Mol]): molecule with the same atoms as mol3Dx
+                containing the conformers;
+            confIds (List[int]): indexes of the conformers
+        
+        Returns:
+            List[bool]: True if total signed volume exceeds the cut-off value,
+                False otherwise
+        '''
+        if not len(confIds):
+            return []
+        finite, Vs = self._CalcStereoCAVolumes(mol, confIds)
+        good = finite & (Vs > self._MinVs[self.geom]) # sum(Vs) > 0
+        
+        return [bool(_) for _ in good]
     
     
-    def Optimize(self, confId = 0, maxIts = 1000):
+    def _CalcStereoCAVolumes(self, mol, confIds):
+        '''Calculates total signed volumes of CA-fac-(DA)3 tetrahedra
+        
+        Arguments:
+            mol (Type[Chem.Mol]): molecule with the same atoms as mol3Dx
+                containing the conformers;
+            confIds (List[int]): indexes of the conformers
+        
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: flags indicating that coordinates
+                of conformers are finite, and total volumes
+        '''
+        coords = np.array([mol.GetConformer(cid).GetPositions() for cid in confIds])
+        Vs = _CalcTHVolumes(coords, self._GetStereoCAIdxs()).sum(axis = 1)
+        
+        return np.isfinite(coords).all(axis = (1, 2)), Vs
+    
+    
+    def _ScreenStereoCAs(self, mol, confIds):
+        '''Cheap check of CA stereo for embedded coordinates before the
+        optimization. Distance geometry yields either correct or mirrored
+        arrangement of donor atoms; the latter is never fixed by the MM
+        optimization. Only conformers with clearly negative volume are
+        rejected, borderline ones are checked after the optimization
+        
+        Arguments:
+            mol (Type[Chem.Mol]): molecule with the same atoms as mol3Dx
+                containing the conformers;
+            confIds (List[int]): indexes of the conformers
+        
+        Returns:
+            List[bool]: False for clearly wrong-handed conformers
+        '''
+        if not len(confIds):
+            return []
+        finite, Vs = self._CalcStereoCAVolumes(mol, confIds)
+        good = finite & ~(Vs < self._ScreenVs[self.geom])
+        
+        return [bool(_) for _ in good]
+    
+    
+    def Optimize(self, confId = 0, maxIts = 1000, forceTol = 1e-4, energyTol = 1e-6):
         '''Optimizes geometry of the given conformer
         
         Arguments:
             confId (int): index of the conformer;
-            maxIts (int): maximal number of optimization steps
+            maxIts (int): maximal number of optimization steps;
+            forceTol (float): convergence criterion on forces;
+            energyTol (float): convergence criterion on energy
         
         Returns:
-            int: 0 if the minimization succeeded
+            int: 0 if the minimization converged
         '''
         self._RaiseErrorInit()
-        # optimization
-        self._SetForceField(confId)
-        self._ff.Initialize()
-        flag = self._ff.Minimize(maxIts = maxIts)
-        # energy
-        E = self._ff.CalcEnergy()
+        # optimization & energy
+        flag, E = self._MinimizeConformer(confId, maxIts, forceTol = forceTol,
+                                          energyTol = energyTol)
         conf3Dx = self.mol3Dx.GetConformer(confId)
         conf3Dx.SetDoubleProp('E', E)
+        conf3Dx.SetBoolProp('Converged', flag == 0)
         # synchronize with mol3D
         conf3D = self.mol3D.GetConformer(confId)
         conf3D.SetDoubleProp('E', E)
+        conf3D.SetBoolProp('Converged', flag == 0)
         for atom in self.mol3D.GetAtoms():
             idx = atom.GetIdx()
             conf3D.SetAtomPosition(idx, conf3Dx.GetAtomPosition(idx))
         # synchronize with mol
         conf = self.mol.GetConformer(confId)
         conf.SetDoubleProp('E', E)
+        conf.SetBoolProp('Converged', flag == 0)
         for atom in self.mol.GetAtoms():
             idx = atom.GetIdx()
             conf.SetAtomPosition(idx, conf3Dx.GetAtomPosition(idx))
@@ -820,23 +1241,77 @@ class Complex():
         return flag
     
     
+    def _CenterConformer(self, confId):
+        '''Moves the central atom of the mol3Dx conformer to (0,0,0)
+        
+        Arguments:
+            confId (int): index of the mol3Dx conformer
+        '''
+        conf3Dx = self.mol3Dx.GetConformer(confId)
+        r = deepcopy(conf3Dx.GetAtomPosition(self._idx_CA))
+        for i in range(conf3Dx.GetNumAtoms()):
+            conf3Dx.SetAtomPosition(i, conf3Dx.GetAtomPosition(i) - r)
+    
+    
+    def _SyncConformer(self, confId, E, rms, converged):
+        '''Saves conformer's properties and copies its coordinates from mol3Dx
+        to mol3D and mol
+        
+        Arguments:
+            confId (int): index of the mol3Dx conformer;
+            E (float): MM energy of the conformer;
+            rms (float): RMSD of the constrained part of the complex, -1 if
+                the conformer was generated without constraints;
+            converged (bool): if the MM optimization converged
+        '''
+        conf3Dx = self.mol3Dx.GetConformer(confId)
+        conf3Dx.SetDoubleProp('E', E)
+        conf3Dx.SetDoubleProp('EmbedRMS', rms)
+        conf3Dx.SetBoolProp('Converged', converged)
+        # synchronize with mol3D
+        conf3D = AllChem.Conformer()
+        conf3D.SetDoubleProp('E', E)
+        conf3D.SetDoubleProp('EmbedRMS', rms)
+        conf3D.SetBoolProp('Converged', converged)
+        for atom in self.mol3D.GetAtoms():
+            idx = atom.GetIdx()
+            conf3D.SetAtomPosition(idx, conf3Dx.GetAtomPosition(idx))
+        self.mol3D.AddConformer(conf3D, assignId = True)
+        # synchronize with mol
+        conf = AllChem.Conformer()
+        conf.SetDoubleProp('E', E)
+        conf.SetDoubleProp('EmbedRMS', rms)
+        conf.SetBoolProp('Converged', converged)
+        for atom in self.mol.GetAtoms():
+            idx = atom.GetIdx()
+            conf.SetAtomPosition(idx, conf3Dx.GetAtomPosition(idx))
+        self.mol.AddConformer(conf, assignId = True)
+    
+    
     def AddConformer(self, clearConfs = True, useRandomCoords = True,
-                     maxAttempts = 10):
-        '''Generates a new conformer
+                     maxAttempts = 10, maxIts = 1000, forceTol = 1e-4, energyTol = 1e-6):
+        '''Generates a new conformer. Convergence of its MM optimization
+        is available via the IsConfConverged method
         
         Arguments:
             clearConfs (bool): if True, removes earlier generated conformers;
             useRandomCoords (bool): use random coordinated during embedding
                 (using False is not recommended);
-            maxAttempts (int): maximal number of attempts to generate a conformer
+            maxAttempts (int): maximal number of attempts to generate a conformer;
+            maxIts (int): maximal number of optimization steps;
+            forceTol (float): convergence criterion of optimization on forces;
+            energyTol (float): convergence criterion of optimization on energy
         
         Returns:
             int: index of generated conformer, and -1 if generation fails
+                or the complex is geometrically infeasible (see err_embed)
         '''
         self._RaiseErrorInit()
         # check embedding prerequisites
         if not self._embedding_prepared:
             self._SetEmbedding()
+        if self.err_embed:
+            return -1
         # set embedding parameters
         params = rdDG.EmbedParameters()
         params.clearConfs = clearConfs
@@ -850,15 +1325,24 @@ class Complex():
         while flag == -1 and attempt > 0:
             attempt -= 1
             # embedding
-            flag = AllChem.EmbedMolecule(self.mol3Dx, params)
+            self._Count('embed_attempts')
+            with _GetTimer(self._stats, 'embed'):
+                flag = AllChem.EmbedMolecule(self.mol3Dx, params)
             if flag == -1:
+                self._Count('embed_failures')
+                continue
+            # skip optimization of wrong-handed conformers
+            if not self._ScreenStereoCAs(self.mol3Dx, [flag])[0]:
+                self._Count('stereo_screened')
+                self.mol3Dx.RemoveConformer(flag)
+                flag = -1
                 continue
             # optimization # HINT: do not use self.Optimize as we need to apply self._CheckStereoCA after
-            self._SetForceField(flag)
-            self._ff.Initialize()
-            self._ff.Minimize(maxIts = 1000)
+            flagMin, E = self._MinimizeConformer(flag, maxIts, forceTol = forceTol,
+                                                 energyTol = energyTol)
             # check chiral centers from 3D
             if not self._CheckStereoCA(flag):
+                self._Count('stereo_rejections')
                 self.mol3Dx.RemoveConformer(flag)
                 flag = -1
                 continue
@@ -867,39 +1351,17 @@ class Complex():
                 self.mol.RemoveAllConformers()
                 self.mol3D.RemoveAllConformers()
             # move CA to (0,0,0)
-            conf3Dx = self.mol3Dx.GetConformer(flag)
-            r = deepcopy(conf3Dx.GetAtomPosition(self._idx_CA))
-            for i in range(conf3Dx.GetNumAtoms()):
-                conf3Dx.SetAtomPosition(i, conf3Dx.GetAtomPosition(i) - r)
-            # energy
-            E = self._ff.CalcEnergy()
-            conf3Dx.SetDoubleProp('E', E)
-            conf3Dx.SetDoubleProp('EmbedRMS', -1)
-            # synchronize with mol3D
-            conf3D = AllChem.Conformer()
-            conf3D.SetDoubleProp('E', E)
-            conf3D.SetDoubleProp('EmbedRMS', -1)
-            for atom in self.mol3D.GetAtoms():
-                idx = atom.GetIdx()
-                conf3D.SetAtomPosition(idx, conf3Dx.GetAtomPosition(idx))
-            conf3D.SetId(flag)
-            self.mol3D.AddConformer(conf3D, assignId = True)
-            # synchronize with mol
-            conf = AllChem.Conformer()
-            conf.SetDoubleProp('E', E)
-            conf.SetDoubleProp('EmbedRMS', -1)
-            for atom in self.mol.GetAtoms():
-                idx = atom.GetIdx()
-                conf.SetAtomPosition(idx, conf3Dx.GetAtomPosition(idx))
-            conf.SetId(flag)
-            self.mol.AddConformer(conf, assignId = True)
+            self._CenterConformer(flag)
+            # energy & synchronization
+            self._SyncConformer(flag, E, -1, flagMin == 0)
         
         return flag
     
     
     def AddConstrainedConformer(self, core, confId = 0, clearConfs = True,
                                 useRandomCoords = True, maxAttempts = 10,
-                                engine = 'coordMap', deltaR = 0.01):
+                                engine = 'coordMap', deltaR = 0.01,
+                                maxIts = 1000, forceTol = 1e-4, energyTol = 1e-6):
         '''Generates a new conformer where part of the complex is constrained
         to have particular coordinates
         
@@ -915,20 +1377,80 @@ class Complex():
             engine (str): an algorithm usef to build a constraint:
                     - "coordMap": preferable choice, uses additional MM constraints;
                     - "boundsMatrix": pure BoundsMatrix modification
-            deltaR (float): distances in boundsMatrix are set as d_core +/- deltaR
+            deltaR (float): distances in boundsMatrix are set as d_core +/- deltaR;
+            maxIts (int): maximal number of optimization steps;
+            forceTol (float): convergence criterion of optimization on forces;
+            energyTol (float): convergence criterion of optimization on energy
         
         Returns:
             int: index of generated conformer, and -1 if generation fails
+                or the complex is geometrically infeasible (see err_embed)
         '''
+        self._CheckConstraintArgs(core, engine)
+        # check embedding prerequisites
+        if not self._embedding_prepared:
+            self._SetEmbedding()
+        if self.err_embed:
+            return -1
+        context = self._PrepareConstrainedEmbedding(core, confId, deltaR)
+        
+        return self._EmbedConstrained(context, clearConfs, useRandomCoords,
+                                      maxAttempts, engine, maxIts, forceTol, energyTol)
+    
+    
+    def _CheckConstraintArgs(self, core, engine):
+        '''Checks arguments of the constrained embedding'''
         if len(Chem.GetMolFrags(core.mol)) != 1:
             raise ValueError('Bad core: core must contain exactly one fragment')
         if engine not in ('coordMap', 'boundsMatrix'):
             raise ValueError('Unknown engine: must be one of "coordMap" or "boundsMatrix"')
-        # make mol3Dx and mol3D
-        if not self._embedding_prepared:
-            self._SetEmbedding()
+        
+        return
+    
+    
+    def _GetCoreMol(self, confId):
+        '''Returns the molecule used as a core for the constrained embedding
+        of other complexes and coordinates of its conformer. They are prepared
+        once and stored until the conformer is modified
+        
+        Arguments:
+            confId (int): index of the conformer
+        
+        Returns:
+            Tuple[Type[Chem.Mol], np.ndarray]: core molecule and coordinates
+                of its conformer of shape (n_atoms, 3)
+        '''
+        pos = self.mol.GetConformer(confId).GetPositions()
+        cache = self._core_cache
+        if cache is None or cache[0] is not self.mol:
+            cache = (self.mol, {})
+            self._core_cache = cache
+        if confId in cache[1] and np.array_equal(cache[1][confId][0], pos):
+            return cache[1][confId][1:]
+        core_mol = _RemoveRs(deepcopy(self.mol)) # HINT: cannot convert to SMARTS: RDKIT #3774
+        coords = core_mol.GetConformer(confId).GetPositions()
+        cache[1][confId] = (pos, core_mol, coords)
+        
+        return core_mol, coords
+    
+    
+    def _PrepareConstrainedEmbedding(self, core, confId, deltaR):
+        '''Prepares data required for the embedding constrained by the core
+        conformer. It is computed once and reused for all generated conformers;
+        the unconstrained embedding must be prepared before (see _SetEmbedding)
+        
+        Arguments:
+            core (Type[Complex]): complex which is a substructure of the initial one;
+            confId (int): index of the core complex's conformer;
+            deltaR (float): distances in boundsMatrix are set as d_core +/- deltaR
+        
+        Returns:
+            dict: core molecule ("core_mol"), coordinates of its conformer
+                ("coords"), substructure match ("match"), coordinate map
+                ("coordMap"), and bounds matrix ("boundsMatrix")
+        '''
         # prepare molecule for substructure search
-        core_mol = _RemoveRs(deepcopy(core.mol)) # HINT: cannot convert to SMARTS: RDKIT #3774
+        core_mol, coords = core._GetCoreMol(confId)
         # substructure check
         match = self.mol3Dx.GetSubstructMatch(core_mol, useChirality = True)
         if not match:
@@ -937,9 +1459,8 @@ class Complex():
             raise ValueError('Bad core: core must contain the central atom')
         # prepare embed params
         coordMap = {}
-        coreConf = core_mol.GetConformer(confId)
         for i, idxI in enumerate(match):
-            coordMap[idxI] = coreConf.GetAtomPosition(i)
+            coordMap[idxI] = Point3D(*coords[i])
         # check if some DAs missed in new coordMap
         add = [idx for idx in self._coordMap if idx not in match]
         if add:
@@ -960,48 +1481,78 @@ class Complex():
                 coordMap[idx] = dummy.GetConformer().GetAtomPosition(dummyMap[idx])
         # set bounds matrix
         BM = rdDG.GetMoleculeBoundsMatrix(self.mol3Dx)
-        for (i, ri), (j, rj) in combinations(coordMap.items(), r = 2):
-            d = sum([_**2 for _ in list(ri-rj)])**0.5
-            BM[min(i,j)][max(i,j)] = d + deltaR
-            BM[max(i,j)][min(i,j)] = d - deltaR
+        idxs = np.array(list(coordMap.keys()))
+        xyz = np.array([list(p) for p in coordMap.values()])
+        D = np.sqrt( ((xyz[:,None,:] - xyz[None,:,:])**2).sum(axis = 2) )
+        I, J = idxs[:,None], idxs[None,:]
+        BM[np.ix_(idxs, idxs)] = np.where(I < J, D + deltaR, np.where(I > J, D - deltaR, 0.0))
+        context = {'core_mol': core_mol, 'coords': coords, 'match': match,
+                   'coordMap': coordMap, 'boundsMatrix': BM}
+        
+        return context
+    
+    
+    def _EmbedConstrained(self, context, clearConfs, useRandomCoords,
+                          maxAttempts, engine, maxIts, forceTol, energyTol):
+        '''Generates a new conformer using the prepared constrained-embedding
+        context (see _PrepareConstrainedEmbedding)
+        
+        Returns:
+            int: index of generated conformer, and -1 if generation fails
+        '''
+        core_mol = context['core_mol']
+        match = context['match']
+        coordMap = context['coordMap']
         # embedding parameters
         params = rdDG.EmbedParameters()
         params.clearConfs = clearConfs
         params.enforceChirality = True
         params.useRandomCoords = useRandomCoords
         #params.embedFragmentsSeparately = False
-        params.SetBoundsMat(BM)
+        params.SetBoundsMat(context['boundsMatrix'])
         # embedding
         flag = -1
         attempt = maxAttempts
+        algMap = [(j, i) for i, j in enumerate(match)]
         while flag == -1 and attempt > 0:
             attempt -= 1
-            if engine == 'coordMap':
-                flag = AllChem.EmbedMolecule(self.mol3Dx, coordMap = coordMap,
-                                             clearConfs = clearConfs,
-                                             useRandomCoords = useRandomCoords,
-                                             enforceChirality = True)
-            elif engine == 'boundsMatrix':
-                flag = AllChem.EmbedMolecule(self.mol3Dx, params)
+            self._Count('embed_attempts')
+            with _GetTimer(self._stats, 'embed'):
+                if engine == 'coordMap':
+                    flag = AllChem.EmbedMolecule(self.mol3Dx, coordMap = coordMap,
+                                                 clearConfs = clearConfs,
+                                                 useRandomCoords = useRandomCoords,
+                                                 enforceChirality = True)
+                elif engine == 'boundsMatrix':
+                    flag = AllChem.EmbedMolecule(self.mol3Dx, params)
             if flag == -1:
+                self._Count('embed_failures')
+                continue
+            # skip optimization of wrong-handed conformers
+            if not self._ScreenStereoCAs(self.mol3Dx, [flag])[0]:
+                self._Count('stereo_screened')
+                self.mol3Dx.RemoveConformer(flag)
+                flag = -1
                 continue
             # set ff
             self._SetForceField(flag)
             # reorient core
-            algMap = [(j, i) for i, j in enumerate(match)]
             AllChem.AlignMol(self.mol3Dx, core_mol, atomMap = algMap, maxIters = 200)
             # add tethers
-            conf = core_mol.GetConformer(confId)
-            for i in range(core_mol.GetNumAtoms()):
-                p = conf.GetAtomPosition(i)
-                pIdx = self._ff.AddExtraPoint(p.x, p.y, p.z, fixed = True) - 1
+            for i, (x, y, z) in enumerate(context['coords']):
+                pIdx = self._ff.AddExtraPoint(x, y, z, fixed = True) - 1
                 self._ff.UFFAddDistanceConstraint(pIdx, match[i], False, 0, 0, 100.)
             # optimize
-            self._ff.Initialize()
-            self._ff.Minimize(maxIts = 1000)
+            with _GetTimer(self._stats, 'minimize'):
+                self._ff.Initialize()
+                flagMin = self._ff.Minimize(maxIts = maxIts, forceTol = forceTol,
+                                            energyTol = energyTol)
+            self._Count('minimizations')
+            self._Count('minimize_not_converged', int(flagMin != 0))
             rms = AllChem.AlignMol(self.mol3Dx, core_mol, atomMap = algMap, maxIters = 200)
             # check chiral centers from 3D
             if not self._CheckStereoCA(flag):
+                self._Count('stereo_rejections')
                 self.mol3Dx.RemoveConformer(flag)
                 flag = -1
                 continue
@@ -1009,27 +1560,8 @@ class Complex():
             if clearConfs:
                 self.mol.RemoveAllConformers()
                 self.mol3D.RemoveAllConformers()
-            # energy
-            E = self._ff.CalcEnergy()
-            conf3Dx = self.mol3Dx.GetConformer(flag)
-            conf3Dx.SetDoubleProp('E', E)
-            conf3Dx.SetDoubleProp('EmbedRMS', rms)
-            # synchronize with mol3D
-            conf3D = AllChem.Conformer()
-            conf3D.SetDoubleProp('E', E)
-            conf3D.SetDoubleProp('EmbedRMS', rms)
-            for atom in self.mol3D.GetAtoms():
-                idx = atom.GetIdx()
-                conf3D.SetAtomPosition(idx, conf3Dx.GetAtomPosition(idx))
-            self.mol3D.AddConformer(conf3D, assignId = True)
-            # synchronize with mol
-            conf = AllChem.Conformer()
-            conf.SetDoubleProp('E', E)
-            conf.SetDoubleProp('EmbedRMS', rms)
-            for atom in self.mol.GetAtoms():
-                idx = atom.GetIdx()
-                conf.SetAtomPosition(idx, conf3Dx.GetAtomPosition(idx))
-            self.mol.AddConformer(conf, assignId = True)        
+            # energy & synchronization
+            self._SyncConformer(flag, self._ff.CalcEnergy(), rms, flagMin == 0)
         
         return flag
     
@@ -1077,6 +1609,23 @@ class Complex():
         return self.mol3Dx.GetConformer(confId).GetDoubleProp('E')
     
     
+    def IsConfConverged(self, confId):
+        '''Checks if MM optimization of the conformer converged
+        
+        Arguments:
+            confId (int): index of the conformer;
+        
+        Returns:
+            Optional[bool]: True if the optimization converged, and None
+                if the conformer was not optimized by MACE (e.g. read from file)
+        '''
+        conf = self.mol3Dx.GetConformer(confId)
+        if not conf.HasProp('Converged'):
+            return None
+        
+        return conf.GetBoolProp('Converged')
+    
+    
     def GetMinEnergyConfId(self, i):
         '''Returns index of the conformer with the i-th smallest energy
         
@@ -1113,13 +1662,17 @@ class Complex():
         return
     
     
-    def GetRepresentativeConfs(self, numConfs = 5, dE = 25.0, dropCloseEnergy = True):
-        '''Returns IDs of approximately most distant conformers (greedy approach)
+    def GetRepresentativeConfs(self, numConfs = 5, dE = 25.0, dropCloseEnergy = True,
+                               numProcs = 1):
+        '''Returns IDs of approximately most distant conformers (greedy approach).
+        RMSD matrix is calculated for heavy atoms taking into account molecular
+        symmetry; conformers are not modified
         
         Arguments:
             numConfs (int): maximal number of conformers to select;
             dE (float): maximal allowed relative energy of conformer;
-            dropCloseEnergy (bool): drops conformers with close energy (delta-E < 0.1).
+            dropCloseEnergy (bool): drops conformers with close energy (delta-E < 0.1);
+            numProcs (int): number of processes used for the RMSD matrix calculation
         
         Returns:
             List[int]: list of conformers' IDs
@@ -1136,10 +1689,8 @@ class Complex():
         if len(idxs) <= numConfs:
             return idxs
         # get RMSD matrix
-        M = np.zeros( [len(idxs), len(idxs)] )
-        for (i, ii), (j, jj) in combinations(enumerate(idxs), 2):
-            Chem.rdMolAlign.AlignMolConformers(self.mol, confIds = [ii, jj])
-            M[i,j] = M[j,i] = Chem.rdMolAlign.CalcRMS(self.mol, self.mol, ii, jj)
+        coords = _GetCoords(self.mol, idxs)
+        M = _CalcRMSMatrix(coords, _GetAtomPermutations(self.mol), numProcs = numProcs)
         # greedy selection
         picked = [0]
         while len(picked) < numConfs:
@@ -1150,49 +1701,162 @@ class Complex():
         return idxs
     
     
+    def _OptimizeConformers(self, mol, confIds, numThreads, maxIts, forceTol, energyTol):
+        '''Minimizes MM energy of conformers of the molecule. Conformers are
+        optimized in bulk for the default convergence criteria (others are not
+        supported by OptimizeMoleculeConfs) and one by one otherwise
+        
+        Arguments:
+            mol (Type[Chem.Mol]): molecule with the same atoms as mol3Dx;
+            confIds (List[int]): indexes of conformers;
+            numThreads (int): number of threads used for bulk optimization;
+            maxIts (int): maximal number of optimization steps;
+            forceTol (float): convergence criterion on forces;
+            energyTol (float): convergence criterion on energy
+        
+        Returns:
+            List[Tuple[int, float]]: 0 if the minimization converged, and MM
+                energy for each conformer
+        '''
+        if forceTol != 1e-4 or energyTol != 1e-6:
+            Es = [self._MinimizeConformer(cid, maxIts, mol, forceTol, energyTol) for cid in confIds]
+        else:
+            self._SetForceField(confIds[0], mol)
+            with _GetTimer(self._stats, 'minimize'):
+                Es = AllChem.OptimizeMoleculeConfs(mol, self._ff, numThreads = numThreads,
+                                                   maxIters = maxIts)
+            self._Count('minimizations', len(confIds))
+            self._Count('minimize_not_converged', sum([int(conv != 0) for conv, _ in Es]))
+        
+        return Es
+    
+    
     def AddConformers(self, numConfs = 10, clearConfs = True,
                       useRandomCoords = True, maxAttempts = 10,
-                      rmsThresh = -1):
-        '''Generates several new conformers
+                      rmsThresh = -1, numThreads = 1, randomSeed = -1,
+                      maxIts = 1000, forceTol = 1e-4, energyTol = 1e-6,
+                      funnelIts = None, funnelDE = 25.0):
+        '''Generates several new conformers. Conformers are generated
+        in batches: all missing conformers are embedded at once, optimized
+        together, and checked for the stereochemistry of the central atom;
+        the failed ones are regenerated in the next batch.
+        
+        In the funnel mode (funnelIts is not None), conformers of the batch
+        are first optimized for funnelIts steps, and only those with energy
+        within funnelDE from the lowest one (among the batch and conformers
+        accepted earlier) are optimized to convergence. Discarded conformers
+        count as generated ones, so the method can return less than numConfs
+        conformers; such high-energy conformers would be rejected by
+        GetRepresentativeConfs anyway
         
         Arguments:
-            numConfs (int): if True, removes earlier generated conformers;
+            numConfs (int): number of conformers to generate;
             clearConfs (bool): if True, removes earlier generated conformers;
             useRandomCoords (bool): use random coordinated during embedding
                 (using False is not recommended);
             maxAttempts (int): maximal number of attempts to generate a conformer;
             rmsThresh (float): if RMSD between two conformers is lower than this value,
                 one of two conformers is dropped from output. If -1, no RMDS filtration
-                is applied. 
+                is applied;
+            numThreads (int): number of threads used for embedding and
+                optimization; if 0, the maximal supported number is used;
+            randomSeed (int): seed of the random number generator used for
+                embedding; if -1, the seed is random;
+            maxIts (int): maximal number of optimization steps;
+            forceTol (float): convergence criterion of optimization on forces;
+            energyTol (float): convergence criterion of optimization on energy;
+            funnelIts (Optional[int]): number of steps of the preliminary
+                optimization; if None, the funnel mode is off. Energies after
+                less than several hundred steps hardly correlate with the final
+                ones for complexes with bulky ligands;
+            funnelDE (float): energy window (in kcal/mol) of the funnel mode
         
         Returns:
             int: list of indexes of generated conformer, empty list if generation fails
+                or the complex is geometrically infeasible (see err_embed)
         '''
         self._RaiseErrorInit()
+        # check embedding prerequisites
+        if not self._embedding_prepared:
+            self._SetEmbedding()
+        if clearConfs:
+            self.RemoveAllConformers()
+        if self.err_embed:
+            return []
+        # set embedding parameters
+        params = rdDG.EmbedParameters()
+        params.clearConfs = True
+        params.enforceChirality = True
+        params.useRandomCoords = useRandomCoords
+        params.numThreads = numThreads
+        params.SetBoundsMat(self._boundsMatrix)
         # generate 3D
         flags = []
-        for i in range(numConfs):
-            clearConfsIter = False if flags else clearConfs
-            flag = self.AddConformer(clearConfs = clearConfsIter,
-                                     useRandomCoords = useRandomCoords,
-                                     maxAttempts = maxAttempts)
-            # check flag and rms
-            if flag == -1:
-                continue
-            if rmsThresh == -1:
-                flags.append(flag)
+        coords = [] # mol3D coordinates of conformers in flags
+        E_min = np.inf # the lowest energy of accepted conformers
+        numLeft = numConfs
+        attempt = maxAttempts
+        while numLeft > 0 and attempt > 0:
+            attempt -= 1
+            # the same seed would reproduce failed conformers
+            if randomSeed != -1:
+                params.randomSeed = randomSeed + maxAttempts - attempt - 1
+            # embed missing conformers at once
+            mol = Chem.Mol(self.mol3Dx)
+            mol.RemoveAllConformers()
+            with _GetTimer(self._stats, 'embed'):
+                cids = list(rdDG.EmbedMultipleConfs(mol, numLeft, params))
+            self._Count('embed_attempts', numLeft)
+            self._Count('embed_failures', numLeft - len(cids))
+            # skip optimization of wrong-handed conformers
+            screened = self._ScreenStereoCAs(mol, cids)
+            for cid, good in zip(cids, screened):
+                if not good:
+                    mol.RemoveConformer(cid)
+            cids = [cid for cid, good in zip(cids, screened) if good]
+            self._Count('stereo_screened', screened.count(False))
+            if not cids:
                 continue
-            # check rms with previous conformers
-            remove_conf = False
-            for cid in flags:
-                rms = AllChem.GetConformerRMS(self.mol3D, cid, flag)
-                if rms < rmsThresh:
-                    remove_conf = True
-                    break
-            if remove_conf:
-                self.RemoveConformer(flag)
-            else:
-                flags.append(flag)
+            # discard high-energy conformers after short optimization
+            if funnelIts is not None:
+                self._SetForceField(cids[0], mol)
+                with _GetTimer(self._stats, 'minimize'):
+                    Es = AllChem.OptimizeMoleculeConfs(mol, self._ff, numThreads = numThreads,
+                                                       maxIters = funnelIts)
+                E_ref = min([E for _, E in Es] + [E_min])
+                keep = [E - E_ref <= funnelDE for _, E in Es]
+                for cid, good in zip(cids, keep):
+                    if not good:
+                        mol.RemoveConformer(cid)
+                cids = [cid for cid, good in zip(cids, keep) if good]
+                numLeft -= keep.count(False)
+                self._Count('funnel_discarded', keep.count(False))
+                if not cids:
+                    continue
+            # optimize them in bulk
+            Es = self._OptimizeConformers(mol, cids, numThreads, maxIts, forceTol, energyTol)
+            goods = self._CheckStereoCAs(mol, cids)
+            self._Count('stereo_rejections', goods.count(False))
+            for cid, (flagMin, E), good in zip(cids, Es, goods):
+                # check chiral centers from 3D
+                if not good:
+                    continue
+                numLeft -= 1
+                E_min = min(E_min, E)
+                # add conformer
+                flag = self.mol3Dx.AddConformer(mol.GetConformer(cid), assignId = True)
+                self._CenterConformer(flag)
+                self._SyncConformer(flag, E, -1, flagMin == 0)
+                # check rms with previous conformers
+                if rmsThresh == -1:
+                    flags.append(flag)
+                    continue
+                xyz = self.mol3D.GetConformer(flag).GetPositions()
+                if flags and _CalcRMSToSet(coords, xyz).min() < rmsThresh:
+                    self.RemoveConformer(flag)
+                else:
+                    flags.append(flag)
+                    coords.append(xyz)
         
         return flags
     
@@ -1200,7 +1864,8 @@ class Complex():
     def AddConstrainedConformers(self, core, confId = 0, numConfs = 10,
                                  clearConfs = True, useRandomCoords = True,
                                  maxAttempts = 10, engine = 'coordMap',
-                                 deltaR = 0.01, rmsThresh = -1):
+                                 deltaR = 0.01, rmsThresh = -1,
+                                 maxIts = 1000, forceTol = 1e-4, energyTol = 1e-6):
         '''Generates several new conformers where part of the complex is constrained
         to have particular coordinates
         
@@ -1220,21 +1885,29 @@ class Complex():
             deltaR (float): distances in boundsMatrix are set as d_core +/- deltaR
             rmsThresh (float): if RMSD between two conformers is lower than this value,
                 one of two conformers is dropped from output. If -1, no RMDS filtration
-                is applied. 
+                is applied;
+            maxIts (int): maximal number of optimization steps;
+            forceTol (float): convergence criterion of optimization on forces;
+            energyTol (float): convergence criterion of optimization on energy
         
         Returns:
             int: list of indexes of generated conformer, empty list if generation fails
+                or the complex is geometrically infeasible (see err_embed)
         '''
         self._RaiseErrorInit()
+        self._CheckConstraintArgs(core, engine)
+        # check embedding prerequisites
+        if not self._embedding_prepared:
+            self._SetEmbedding()
+        if self.err_embed:
+            return []
+        context = self._PrepareConstrainedEmbedding(core, confId, deltaR)
         # generate 3D
         flags = []
         for i in range(numConfs):
             clearConfsIter = False if flags else clearConfs
-            flag = self.AddConstrainedConformer(core, confId = confId,
-                                                clearConfs = clearConfsIter,
-                                                useRandomCoords = useRandomCoords,
-                                                maxAttempts = maxAttempts,
-                                                engine = engine, deltaR = deltaR)
+            flag = self._EmbedConstrained(context, clearConfsIter, useRandomCoords,
+                                          maxAttempts, engine, maxIts, forceTol, energyTol)
             # check flag and rms
             if flag == -1:
                 continue
@@ -1242,13 +1915,8 @@ class Complex():
                 flags.append(flag)
                 continue
             # check rms with previous conformers
-            remove_conf = False
-            for cid in flags:
-                rms = AllChem.GetConformerRMS(self.mol3D, cid, flag)
-                if rms < rmsThresh:
-                    remove_conf = True
-                    break
-            if remove_conf:
+            xyz = self.mol3D.GetConformer(flag).GetPositions()
+            if flags and _CalcRMSToSet(_GetCoords(self.mol3D, flags), xyz).min() < rmsThresh:
                 self.RemoveConformer(flag)
             else:
                 flags.append(flag)
@@ -1301,76 +1969,105 @@ class Complex():
     
 #%% Output
     
-    def _ConfToXYZ(self, confId):
-        '''Generates text block of the XYZ file
-        
-        Arguments:
-            confId (int): index of the conformer
+    def _GetXYZHeader(self):
+        '''Prepares conformer-independent part of XYZ blocks: template
+        of coordinate lines and topology info
         
         Returns:
-            str: text block of the XYZ file
+            Tuple[str, dict]: template of coordinate lines and info dict
         '''
-        # coordinates
-        xyz = []
-        conf = self.mol3Dx.GetConformer(confId) # not mol3D as it uses in AlignMol
+        # coordinates template
+        lines = []
         for atom in self.mol3D.GetAtoms():
             symbol = atom.GetSymbol()
             if symbol == '*':
                 symbol = 'X'
-            pos = conf.GetAtomPosition(atom.GetIdx())
-            line = f'{symbol:2} {pos.x:>-10.4f} {pos.y:>-10.4f} {pos.z:>-10.4f}'
-            xyz.append(line)
-        # conf params
-        E = conf.GetDoubleProp('E')
-        rms = conf.GetDoubleProp('EmbedRMS')
-        # mol smiles
-        mol = deepcopy(self.mol)
-        for atom in mol.GetAtoms():
-            atom.SetAtomMapNum(atom.GetIdx())
-        smiles = Chem.MolToSmiles(mol, canonical = False)
-        # mol3D smiles
-        mol3D = deepcopy(self.mol3D)
-        for atom in mol3D.GetAtoms():
-            atom.SetAtomMapNum(atom.GetIdx())
-        smiles3D = Chem.MolToSmiles(mol3D, canonical = False)
-        # mol3Dx smiles
-        mol3Dx = deepcopy(self.mol3Dx)
-        for atom in mol3Dx.GetAtoms():
-            atom.SetAtomMapNum(atom.GetIdx())
-        smiles3Dx = Chem.MolToSmiles(mol3Dx, canonical = False)
-        # dummies' coords
-        dummies = []
-        conf3Dx = mol3Dx.GetConformer(confId)
-        for i in range(mol3D.GetNumAtoms(), mol3Dx.GetNumAtoms()):
-            if i < mol3D.GetNumAtoms():
-                continue
-            p = conf3Dx.GetAtomPosition(i)
-            dummies += [p.x, p.y, p.z]
-        # make text
-        info = {'conf': confId, 'E': float(f'{E:.2f}'),
-                'rms': float(f'{rms:.4f}'), 'geom': self.geom,
+            lines.append(f'{symbol:2} %10.4f %10.4f %10.4f')
+        template = '\n'.join([str(len(lines)), '%s'] + lines) + '\n'
+        # smiles with atom indexes as map numbers
+        smiles = {}
+        for name in ('mol', 'mol3D', 'mol3Dx'):
+            mol = Chem.Mol(getattr(self, name))
+            mol.RemoveAllConformers()
+            for atom in mol.GetAtoms():
+                atom.SetAtomMapNum(atom.GetIdx())
+            smiles[name] = Chem.MolToSmiles(mol, canonical = False)
+        info = {'geom': self.geom,
                 'total_charge': sum([a.GetFormalCharge() for a in self.mol.GetAtoms()]),
                 'CA_charge': self.mol.GetAtomWithIdx(self._idx_CA).GetFormalCharge(),
-                'smiles': smiles, 'smiles3D': smiles3D,
-                'smiles3Dx': smiles3Dx, 'dummies': dummies}
-        text = [str(len(xyz)), json.dumps(info)] + xyz
+                'smiles': smiles['mol'], 'smiles3D': smiles['mol3D'],
+                'smiles3Dx': smiles['mol3Dx']}
         
-        return '\n'.join(text)+'\n'
+        return template, info
     
     
-    def ToXYZBlock(self, confId = None):
-        '''Generates text block of XYZ file
+    def _WriteXYZ(self, outf, confIds):
+        '''Writes conformers to the file-like object one by one
         
         Arguments:
-            confId (Optional[int]): conformer Id; if None, 0-th conformer is saved
+            outf (file-like object): opened text stream;
+            confIds (List[int]): ordered list of conformer Ids
+        '''
+        template, header = self._GetXYZHeader()
+        N = self.mol3D.GetNumAtoms()
+        for confId in confIds:
+            conf = self.mol3Dx.GetConformer(confId) # not mol3D as it uses in AlignMol
+            coords = conf.GetPositions()
+            E = conf.GetDoubleProp('E')
+            rms = conf.GetDoubleProp('EmbedRMS')
+            info = {'conf': confId, 'E': float(f'{E:.2f}'),
+                    'rms': float(f'{rms:.4f}'), **header,
+                    'dummies': coords[N:].ravel().tolist()}
+            outf.write(template % (json.dumps(info), *coords[:N].ravel()))
+        
+        return
+    
+    
+    def _PrepareXYZConfIds(self, confIds = None):
+        '''Checks that complex has conformers and returns their Ids
+        
+        Arguments:
+            confIds (Optional[List[int]]): ordered list of conformer Ids;
+                if None, all conformers are used
         
         Returns:
-            str: text block of the XYZ file
+            List[int]: ordered list of conformer Ids
         '''
         self._RaiseErrorInit()
         N = self.mol3D.GetNumConformers()
         if not N:
             raise ValueError('Bad conformer ID: complex has no conformers')
+        if confIds is None:
+            confIds = sorted([conf.GetId() for conf in self.mol3D.GetConformers()])
+        
+        return confIds
+    
+    
+    def _ConfToXYZ(self, confId):
+        '''Generates text block of the XYZ file
+        
+        Arguments:
+            confId (int): index of the conformer
+        
+        Returns:
+            str: text block of the XYZ file
+        '''
+        outf = io.StringIO()
+        self._WriteXYZ(outf, [confId])
+        
+        return outf.getvalue()
+    
+    
+    def ToXYZBlock(self, confId = None):
+        '''Generates text block of XYZ file
+        
+        Arguments:
+            confId (Optional[int]): conformer Id; if None, 0-th conformer is saved
+        
+        Returns:
+            str: text block of the XYZ file
+        '''
+        self._PrepareXYZConfIds()
         # prepare conf idxs
         if confId is None:
             confId = 0
@@ -1388,19 +2085,40 @@ class Complex():
         Returns:
             str: text block of the multiple XYZ file
         '''
-        self._RaiseErrorInit()
-        N = self.mol3D.GetNumConformers()
-        if not N:
-            raise ValueError('Bad conformer ID: complex has no conformers')
-        # prepare conf idxs
-        if confIds is None:
-            confIds = sorted([conf.GetId() for conf in self.mol3D.GetConformers()])
-        # get text
-        text = ''
-        for confId in confIds:
-            text += self._ConfToXYZ(confId)
+        confIds = self._PrepareXYZConfIds(confIds)
+        outf = io.StringIO()
+        self._WriteXYZ(outf, confIds)
+        
+        return outf.getvalue()
+    
+    
+    def ToEnsembleFile(self, path, confIds = None, dtype = 'float64'):
+        '''Saves conformers as a compact binary ensemble file (uncompressed
+        NumPy .npz archive). The topology of the complex is stored once,
+        and coordinates of all conformers are stored as a single array,
+        so the file can be memory-mapped on reading
+        
+        Arguments:
+            path (str): file path;
+            confIds (Optional[List[int]]): ordered list of conformer Ids
+                to save. If None, all conformers are saved;
+            dtype (str): type of coordinates, "float64" or "float32"
+        '''
+        if dtype not in ('float64', 'float32'):
+            raise ValueError('Bad dtype: must be "float64" or "float32"')
+        confIds = self._PrepareXYZConfIds(confIds)
+        _, info = self._GetXYZHeader()
+        info['atoms'] = ['X' if a.GetSymbol() == '*' else a.GetSymbol() for a in self.mol3D.GetAtoms()]
+        confs = [self.mol3Dx.GetConformer(confId) for confId in confIds]
+        with open(path, 'wb') as outf:
+            np.savez(outf,
+                     topology = np.array(json.dumps(info)),
+                     conf = np.array(confIds, dtype = np.int64),
+                     E = np.array([conf.GetDoubleProp('E') for conf in confs]),
+                     rms = np.array([conf.GetDoubleProp('EmbedRMS') for conf in confs]),
+                     coords = np.array([conf.GetPositions() for conf in confs], dtype = dtype))
         
-        return text
+        return
     
     
     def ToXYZ(self, path, confId = None):
@@ -1423,8 +2141,8 @@ class Complex():
             confIds (Optional[List[int]]): ordered list of conformer Ids
                 to include in XYZ-block. If None, all conformers are saved
         '''
-        text = self.ToMultipleXYZBlock(confIds)
+        confIds = self._PrepareXYZConfIds(confIds)
         with open(path, 'w') as outf:
-            outf.write(text)
+            self._WriteXYZ(outf, confIds)
 
 
@@ -8,13 +8,15 @@ from itertools import combinations
 from copy import deepcopy
 from collections import namedtuple
 
+import numpy as np
+
 from rdkit.Geometry.rdGeometry import Point3D
 
 
 #%% Params object
 
 params = namedtuple('ComplexParams', ['FFParams', 'Rcov', 'Syms', 'Geoms',
-                                      'Bounds', 'PosVs', 'MinVs', 'EqOrs',
+                                      'Bounds', 'BoundsArrays', 'PosVs', 'MinVs', 'ScreenVs', 'EqOrs',
                                       'Nears', 'Angles'])
 
 # force field parameters
@@ -114,6 +116,13 @@ for (i, lab1), (j, lab2) in combinations(enumerate(labs), r = 2):
     SP[lab2][lab1] = X[j][i]
 # add to params
 params.Bounds = {'OH': OH, 'SP': SP}
+# the same as arrays: label => index, upper and lower bounds
+params.BoundsArrays = {}
+for geom, B in params.Bounds.items():
+    labs = list(B.keys())
+    upper = np.array([[max(B[lab1][lab2], B[lab2][lab1]) for lab2 in labs] for lab1 in labs])
+    lower = np.array([[min(B[lab1][lab2], B[lab2][lab1]) for lab2 in labs] for lab1 in labs])
+    params.BoundsArrays[geom] = ({lab: i for i, lab in enumerate(labs)}, upper, lower)
 
 # lists of points corresponding to positive tetrahedra volumes
 params.PosVs = {'OH': [['CA',1,2,3],
@@ -136,6 +145,10 @@ params.PosVs = {'OH': [['CA',1,2,3],
 # minimal volumes of polyhedra around CA (to check CA stereo)
 params.MinVs = {'OH': 4/3, 'SP': 2/3}
 
+# volumes of polyhedra around CA in raw embedded coordinates below which
+# conformers are rejected before the optimization (wrong CA stereo)
+params.ScreenVs = {'OH': -4.0, 'SP': -2.0}
+
 # equivalent orientations of complexes
 params.EqOrs = {'OH': {1: [1,1,1,1,2,2,2,2,3,3,3,3,4,4,4,4,5,5,5,5,6,6,6,6],
                        2: [2,3,4,5,1,5,6,3,1,2,6,4,1,3,6,5,1,4,6,2,2,5,4,3],
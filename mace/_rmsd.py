@@ -0,0 +1,193 @@
+'''Vectorized calculation of RMSD between conformers'''
+
+#%% Imports
+
+from typing import List, Optional, Type
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from rdkit import Chem
+
+
+#%% Coordinates and symmetry
+
+def _GetCoords(mol, confIds, atomIdxs = None):
+    '''Extracts coordinates of conformers as a single array. Conformers
+    are not modified
+    
+    Arguments:
+        mol (Type[Chem.Mol]): RDKit molecule;
+        confIds (List[int]): indexes of conformers;
+        atomIdxs (Optional[List[int]]): indexes of atoms to extract;
+            if None, all atoms are used
+    
+    Returns:
+        np.ndarray: coordinates of shape (n_confs, n_atoms, 3)
+    '''
+    coords = np.array([mol.GetConformer(cid).GetPositions() for cid in confIds])
+    if atomIdxs is not None:
+        coords = coords[:, atomIdxs, :]
+    
+    return coords.reshape(len(confIds), -1, 3)
+
+
+def _GetAtomPermutations(mol, maxMatches = 10000):
+    '''Returns atom permutations corresponding to automorphisms of the
+    molecular graph. They are used to get symmetry-corrected RMSD
+    
+    Arguments:
+        mol (Type[Chem.Mol]): RDKit molecule;
+        maxMatches (int): maximal number of permutations
+    
+    Returns:
+        np.ndarray: permutations of shape (n_perms, n_atoms)
+    '''
+    matches = mol.GetSubstructMatches(mol, uniquify = False, useChirality = False,
+                                      maxMatches = maxMatches)
+    if not matches:
+        matches = [tuple(range(mol.GetNumAtoms()))]
+    
+    return np.array(matches, dtype = int)
+
+
+#%% RMSD
+
+def _KabschRMSD(X, Y):
+    '''Calculates RMSD between pairs of structures after their optimal
+    superposition. Only singular values of covariance matrices are used,
+    so rotation matrices are never built
+    
+    Arguments:
+        X (np.ndarray): coordinates of shape (n_pairs, n_atoms, 3);
+        Y (np.ndarray): coordinates of shape (n_pairs, n_atoms, 3)
+    
+    Returns:
+        np.ndarray: RMSD values of shape (n_pairs,)
+    '''
+    X = X - X.mean(axis = 1, keepdims = True)
+    Y = Y - Y.mean(axis = 1, keepdims = True)
+    H = np.einsum('nai,naj->nij', X, Y)
+    s = np.linalg.svd(H, compute_uv = False)
+    s[:,-1] *= np.sign(np.linalg.det(H))
+    msd = ( (X**2).sum(axis = (1, 2)) + (Y**2).sum(axis = (1, 2)) - 2*s.sum(axis = 1) ) / X.shape[1]
+    
+    return np.sqrt(np.maximum(msd, 0.0))
+
+
+def _Superpose(X, Y):
+    '''Centers pairs of structures and rotates the second structure of
+    each pair onto the first one (Kabsch algorithm)
+    
+    Arguments:
+        X (np.ndarray): coordinates of shape (n_pairs, n_atoms, 3);
+        Y (np.ndarray): coordinates of shape (n_pairs, n_atoms, 3)
+    
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: superposed coordinates
+    '''
+    X = X - X.mean(axis = 1, keepdims = True)
+    Y = Y - Y.mean(axis = 1, keepdims = True)
+    U, s, Vt = np.linalg.svd(np.einsum('nai,naj->nij', Y, X))
+    d = np.sign(np.linalg.det(np.matmul(U, Vt)))
+    U[:,:,-1] *= d[:,None]
+    
+    return X, np.matmul(Y, np.matmul(U, Vt))
+
+
+def _PairsRMSD(X, Y, perms = None):
+    '''Calculates RMSD between pairs of structures. If permutations are
+    given, structures are superposed using the initial atom order, then
+    RMSD is minimized over permutations without further superposition
+    (the same as rdMolAlign.AlignMolConformers followed by rdMolAlign.CalcRMS)
+    
+    Arguments:
+        X (np.ndarray): coordinates of shape (n_pairs, n_atoms, 3);
+        Y (np.ndarray): coordinates of shape (n_pairs, n_atoms, 3);
+        perms (Optional[np.ndarray]): atom permutations of shape (n_perms, n_atoms);
+            if None, atoms are not permuted
+    
+    Returns:
+        np.ndarray: RMSD values of shape (n_pairs,)
+    '''
+    if perms is None:
+        return _KabschRMSD(X, Y)
+    X, Y = _Superpose(X, Y)
+    msd = np.full(len(X), np.inf)
+    for perm in perms:
+        msd = np.minimum(msd, ((X - Y[:,perm,:])**2).sum(axis = (1, 2)))
+    
+    return np.sqrt(msd / X.shape[1])
+
+
+def _CalcPairsRMSD(coords, pairs, perms = None):
+    '''Calculates RMSD for given pairs of conformers
+    
+    Arguments:
+        coords (np.ndarray): coordinates of shape (n_confs, n_atoms, 3);
+        pairs (np.ndarray): indexes of conformers of shape (n_pairs, 2);
+        perms (Optional[np.ndarray]): atom permutations of shape (n_perms, n_atoms);
+            if None, atoms are not permuted
+    
+    Returns:
+        np.ndarray: RMSD values of shape (n_pairs,)
+    '''
+    
+    return _PairsRMSD(coords[pairs[:,0]], coords[pairs[:,1]], perms)
+
+
+def _Chunks(pairs, chunkSize):
+    '''Splits array of pairs into chunks'''
+    
+    return [pairs[i:i+chunkSize] for i in range(0, len(pairs), chunkSize)]
+
+
+def _CalcRMSMatrix(coords, perms = None, chunkSize = 2048, numProcs = 1):
+    '''Calculates symmetric matrix of RMSD between all conformers. Pairs of
+    conformers are processed in chunks to limit the memory usage
+    
+    Arguments:
+        coords (np.ndarray): coordinates of shape (n_confs, n_atoms, 3);
+        perms (Optional[np.ndarray]): atom permutations of shape (n_perms, n_atoms);
+            if None, atoms are not permuted;
+        chunkSize (int): number of pairs processed at once;
+        numProcs (int): number of processes; if greater than 1, chunks are
+            distributed over the pool of processes
+    
+    Returns:
+        np.ndarray: RMSD matrix of shape (n_confs, n_confs)
+    '''
+    N = len(coords)
+    M = np.zeros( [N, N] )
+    if N < 2:
+        return M
+    I, J = np.triu_indices(N, k = 1)
+    chunks = _Chunks(np.stack([I, J], axis = 1), chunkSize)
+    if numProcs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers = numProcs) as pool:
+            futures = [pool.submit(_CalcPairsRMSD, coords, chunk, perms) for chunk in chunks]
+            rms = np.concatenate([future.result() for future in futures])
+    else:
+        rms = np.concatenate([_CalcPairsRMSD(coords, chunk, perms) for chunk in chunks])
+    M[I,J] = M[J,I] = rms
+    
+    return M
+
+
+def _CalcRMSToSet(coords, xyz, perms = None):
+    '''Calculates RMSD between a conformer and the set of conformers
+    
+    Arguments:
+        coords (np.ndarray): coordinates of shape (n_confs, n_atoms, 3);
+        xyz (np.ndarray): coordinates of the conformer of shape (n_atoms, 3);
+        perms (Optional[np.ndarray]): atom permutations of shape (n_perms, n_atoms);
+            if None, atoms are not permuted
+    
+    Returns:
+        np.ndarray: RMSD values of shape (n_confs,)
+    '''
+    Y = np.asarray(coords).reshape(-1, len(xyz), 3)
+    X = np.broadcast_to(xyz, Y.shape)
+    
+    return _PairsRMSD(X, Y, perms)
@@ -0,0 +1,75 @@
+'''Optional collection of statistics on stereomer search and 3D generation.
+If disabled, complexes do not store statistics and timers are replaced
+with the shared no-op object, so the overhead is negligible
+'''
+
+#%% Imports
+
+import time
+from contextlib import nullcontext
+
+
+#%% Statistics
+
+_ENABLED = False
+
+# counters and times (in seconds) reported by Complex.GetStats
+_COUNTERS = ('stereomer_candidates', 'stereomers',
+             'embed_attempts', 'embed_failures', 'stereo_screened', 'stereo_rejections',
+             'minimizations', 'minimize_not_converged', 'funnel_discarded')
+_TIMERS = ('comparison', 'stereomers', 'embedding_setup', 'embed',
+           'ff_setup', 'minimize')
+
+_NO_TIMER = nullcontext()
+
+
+class _Timer():
+    '''Context manager adding the elapsed time to the statistics'''
+    
+    def __init__(self, stats, key):
+        '''Constructor'''
+        self.stats = stats
+        self.key = 'time_' + key
+    
+    
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+    
+    
+    def __exit__(self, *args):
+        self.stats[self.key] = self.stats.get(self.key, 0.0) + time.perf_counter() - self.t0
+        return False
+
+
+def _NewStats():
+    '''Returns empty statistics for the new complex or None if the
+    statistics are not collected
+    '''
+    
+    return {} if _ENABLED else None
+
+
+def _GetTimer(stats, key):
+    '''Returns timer for the statistics or no-op context manager'''
+    if stats is None:
+        return _NO_TIMER
+    
+    return _Timer(stats, key)
+
+
+def EnableStats(enable = True):
+    '''Enables or disables collection of statistics by complexes created
+    afterwards: numbers of embedding attempts and failures, rejections of
+    conformers with wrong stereochemistry of the central atom, numbers of
+    minimizations, and time spent in main stages. Statistics of the complex
+    are available via :meth:`mace.Complex.GetStats`
+    
+    Arguments:
+        enable (bool): if True, complexes collect statistics
+    '''
+    global _ENABLED
+    _ENABLED = bool(enable)
+    
+    return
+
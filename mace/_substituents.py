@@ -4,7 +4,7 @@ preserving tetrahedral symmetry
 
 #%% Imports
 
-from typing import Type
+from typing import Type, Dict, List, Tuple, Iterator
 
 from rdkit import Chem
 
@@ -84,6 +84,82 @@ def _CheckSubs(Rs):
     return None
 
 
+def _GetSubsIdxs(mol):
+    '''Returns dummy atoms corresponding to substituents
+    
+    Arguments:
+        mol (Type[Chem.Mol]): RDKit molecule object
+    
+    Returns:
+        List[Tuple[int, str]]: indexes of dummy atoms and substituents names
+    '''
+    needed_Rs = []
+    for atom in mol.GetAtoms():
+        if atom.GetAtomicNum() in (0, 1) and atom.GetIsotope() and not atom.GetAtomMapNum():
+            if 'DATIVE' not in [str(_.GetBondType()) for _ in atom.GetBonds()]:
+                needed_Rs.append( (atom.GetIdx(), f'R{atom.GetIsotope()}') )
+    
+    return needed_Rs
+
+
+def _CheckSubsExist(needed_Rs, names):
+    '''Checks that all substituents required by the molecule are defined
+    
+    Arguments:
+        needed_Rs (List[Tuple[int, str]]): output of _GetSubsIdxs;
+        names (List[str]): names of defined substituents
+    '''
+    absent = set([_[1] for _ in needed_Rs]).difference(set(names))
+    if absent:
+        addend = 's' if len(absent) > 1 else ''
+        absent = ','.join(absent)
+        raise ValueError(f'No {absent} substituent{addend} found in list of Rs')
+    
+    return None
+
+
+def _AttachSub(mol, R, sub):
+    '''Attaches the substituent to all dummy atoms corresponding to it
+    (marked by the "_R" property) and removes these dummies
+    
+    Arguments:
+        mol (Type[Chem.Mol]): RDKit molecule object;
+        R (str): name of the substituent ("R1", "R2", etc.);
+        sub (Type[Chem.Mol]): RDKit molecule of the substituent with
+            the dummy atom labelled by _CheckSubs
+    
+    Returns:
+        Type[Chem.Mol]: RDKit molecule
+    '''
+    idxs = [a.GetIdx() for a in mol.GetAtoms() if a.HasProp('_R') and a.GetProp('_R') == R]
+    if not idxs:
+        return mol
+    N = mol.GetNumAtoms()
+    drop = []
+    for idx1 in idxs:
+        mol = Chem.CombineMols(mol, sub)
+        # find dummie's index in sub
+        idx2 = None
+        for i in range(N, mol.GetNumAtoms()):
+            atom = mol.GetAtomWithIdx(i)
+            if atom.GetSymbol() == '*' and atom.GetIsotope() == int(R[1:]):
+                idx2 = atom.GetIdx()
+                break
+        # create bond
+        mol = _BondByDummies(mol, idx1, idx2)
+        mol.GetAtomWithIdx(idx1).SetIsotope(0)
+        mol.GetAtomWithIdx(idx2).SetIsotope(0)
+        drop += [idx1, idx2]
+    # remove dummies
+    ed = Chem.EditableMol(mol)
+    for idx in sorted(drop, reverse = True):
+        ed.RemoveAtom(idx)
+    mol = ed.GetMol()
+    Chem.SanitizeMol(mol)
+    
+    return mol
+
+
 def AddSubsToMol(mol, Rs):
     '''Adds susbtituents to the molecule
     
@@ -101,17 +177,9 @@ def AddSubsToMol(mol, Rs):
     # check Rs
     _CheckSubs(Rs)
     # get number and type of Rs
-    needed_Rs = []
-    for atom in mol.GetAtoms():
-        if atom.GetAtomicNum() in (0, 1) and atom.GetIsotope() and not atom.GetAtomMapNum():
-            if 'DATIVE' not in [str(_.GetBondType()) for _ in atom.GetBonds()]:
-                needed_Rs.append( (atom.GetIdx(), f'R{atom.GetIsotope()}') )
+    needed_Rs = _GetSubsIdxs(mol)
     # check Rs existence
-    absent = set([_[1] for _ in needed_Rs]).difference(set(Rs.keys()))
-    if absent:
-        addend = 's' if len(absent) > 1 else ''
-        absent = ','.join(absent)
-        raise ValueError(f'No {absent} substituent{addend} found in list of Rs')
+    _CheckSubsExist(needed_Rs, Rs.keys())
     # add Rs
     N = mol.GetNumAtoms()
     drop = []
@@ -141,3 +209,43 @@ def AddSubsToMol(mol, Rs):
     return mol
 
 
+def IterSubsCombinations(mol, Rs):
+    '''Yields molecules with all combinations of substituents. Substituents
+    are attached incrementally (all R1 positions, then all R2 positions, etc.),
+    so combinations sharing the first substituents reuse the same intermediate
+    molecules. Combinations are yielded in the order of itertools.product
+    
+    Arguments:
+        mol (Type[Chem.Mol]): RDKit molecule object, containing dummy atoms
+            with non-zero isotopic labels corresponding to substituents numbers
+            ([1*] <=> R1, [2*] <=> R2, etc.)
+        Rs (dict): substituent name => list of RDKit molecules. Substituents
+            names are "R1", "R2", etc.; molecules must satisfy the same
+            requirements as in AddSubsToMol
+    
+    Yields:
+        Tuple[Tuple[int], Type[Chem.Mol]]: indexes of substituents in the lists
+            of Rs (in the order of Rs keys) and the molecule
+    '''
+    # check Rs
+    names = list(Rs.keys())
+    for R in names:
+        for sub in Rs[R]:
+            _CheckSubs({R: sub})
+    needed_Rs = _GetSubsIdxs(mol)
+    _CheckSubsExist(needed_Rs, names)
+    # mark positions of substituents
+    mol = Chem.Mol(mol)
+    for idx, R in needed_Rs:
+        mol.GetAtomWithIdx(idx).SetProp('_R', R)
+    # depth-first attachment
+    def _Iter(mol, level, idxs):
+        if level == len(names):
+            # remove Hs since some subs can be hydrogens
+            yield idxs, Chem.RemoveHs(mol)
+            return
+        R = names[level]
+        for i, sub in enumerate(Rs[R]):
+            yield from _Iter(_AttachSub(mol, R, sub), level + 1, idxs + (i,))
+    
+    yield from _Iter(mol, 0, ())
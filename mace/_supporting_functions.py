@@ -2,15 +2,38 @@
 
 #%% Imports
 
-from typing import Type, List
+from typing import Type, List, Iterable
 
 from copy import deepcopy
 
+import numpy as np
+
 from rdkit import Chem
 
 
 #%% Functions
 
+def _CalcTHVolumes(coords, idxs):
+    '''Calculates signed volumes of several tetrahedra at once. Works with
+    both single set of atomic coordinates and a stack of conformers
+    
+    Arguments:
+        coords (np.ndarray): atomic coordinates, array of shape (n_atoms, 3)
+            or (n_confs, n_atoms, 3);
+        idxs (np.ndarray): indexes of atoms forming tetrahedra, array of
+            shape (n_tetrahedra, 4)
+    
+    Returns:
+        np.ndarray: signed volumes of shape (n_tetrahedra,) or
+            (n_confs, n_tetrahedra), Angstroem^3
+    '''
+    ps = np.asarray(coords, dtype = float)[..., np.asarray(idxs), :]
+    vs = ps[..., 1:, :] - ps[..., :1, :]
+    prod = np.cross(vs[..., 0, :], vs[..., 1, :])
+    
+    return np.einsum('...i,...i->...', prod, vs[..., 2, :])/6
+
+
 def _CalcTHVolume(conf, idxs):
     '''Calculates signed volume of tetrahedra formed by four given atoms
     
@@ -21,13 +44,9 @@ def _CalcTHVolume(conf, idxs):
     Returns:
         float: signed volume, Angstroem^3
     '''
-    ps = [conf.GetAtomPosition(idx) for idx in idxs]
-    v1 = [ps[1].x-ps[0].x, ps[1].y-ps[0].y, ps[1].z-ps[0].z]
-    v2 = [ps[2].x-ps[0].x, ps[2].y-ps[0].y, ps[2].z-ps[0].z]
-    v3 = [ps[3].x-ps[0].x, ps[3].y-ps[0].y, ps[3].z-ps[0].z]
-    prod = [v1[1]*v2[2]-v1[2]*v2[1], v1[2]*v2[0]-v1[0]*v2[2], v1[0]*v2[1]-v1[1]*v2[0]]
+    ps = np.array([list(conf.GetAtomPosition(idx)) for idx in idxs])
     
-    return sum([x*y for x, y in zip(prod, v3)])/6
+    return float(_CalcTHVolumes(ps, [[0, 1, 2, 3]])[0])
 
 
 def _RemoveRs(mol):
@@ -49,3 +68,64 @@ def _RemoveRs(mol):
     return Chem.RemoveHs(mol)
 
 
+def _GetAutomorphisms(mol, maxMatches = 10000):
+    '''Returns automorphisms of the molecular graph consistent with
+    stereochemistry of the molecule. Matches mapping atoms to atoms
+    of different canonical rank (accounting for stereo) are dropped
+    
+    Arguments:
+        mol (Type[Chem.Mol]): RDKit molecule;
+        maxMatches (int): maximal number of substructure matches to consider
+    
+    Returns:
+        List[Tuple[int]]: automorphisms; i-th atom is mapped to automorphism[i]-th
+    '''
+    ranks = list(Chem.CanonicalRankAtoms(mol, breakTies = False, includeChirality = True))
+    matches = mol.GetSubstructMatches(mol, uniquify = False, useChirality = True,
+                                      maxMatches = maxMatches)
+    
+    return [m for m in matches if all([ranks[j] == ranks[i] for i, j in enumerate(m)])]
+
+
+def _PermutationParity(perm):
+    '''Returns parity of the permutation
+    
+    Arguments:
+        perm (List[int]): permutation of range(len(perm))
+    
+    Returns:
+        int: 0 for even and 1 for odd permutation
+    '''
+    parity = 0
+    for i in range(len(perm)):
+        for j in range(i + 1, len(perm)):
+            if perm[i] > perm[j]:
+                parity ^= 1
+    
+    return parity
+
+
+def _UniqueStereomers(stereomers, dropEnantiomers = True):
+    '''Yields stereomers skipping the ones identical to earlier yielded.
+    Instead of pairwise Complex.IsEqual and Complex.IsEnantiomer calls,
+    _ID SMILES of yielded stereomers are stored in a set, so each check
+    is a lookup of stereomer's _ID/_eID SMILES in that set
+    
+    Arguments:
+        stereomers (Iterable[Type[Complex]]): complexes to filter;
+        dropEnantiomers (bool): if True, enantiomers of yielded complexes
+            are skipped as well
+    
+    Returns:
+        Iterable[Type[Complex]]: unique complexes in the initial order
+    '''
+    seen = set()
+    for X in stereomers:
+        if not seen.isdisjoint(X._ID):
+            continue
+        if dropEnantiomers and not seen.isdisjoint(X._eID):
+            continue
+        seen.update(X._ID)
+        yield X
+
+
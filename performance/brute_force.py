@@ -1,10 +1,20 @@
 '''
-Tests MACE code
+Tests MACE code: throughput benchmark on CSD ligands. Systems can be
+split into shards processed on different nodes and distributed over
+the pool of processes; each ligand has its own fixed random seed, so
+results do not depend on sharding and the number of processes
+
+Usage (from the root directory of the repository):
+    python -m performance.brute_force [--shard 0/4] [--n-jobs 8] [--report shard0.json]
+    python -m performance.brute_force --merge shard0.json shard1.json ...
 '''
 
 #%% Imports
 
-import os, time
+import os, time, json, argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 from mace import ComplexFromLigands
 
@@ -30,20 +40,16 @@ def read_ligands(path):
     return info
 
 
-
-#%% Read ligands
+#%% Systems
 
 # paths
-path_ls = 'ligands/cleared_ligands/csd_ligands.csv'
-path_xyz = 'outputs'
+path_root = os.path.dirname(os.path.abspath(__file__))
+path_ls = os.path.join(path_root, 'ligands/cleared_ligands/csd_ligands.csv')
+path_xyz = os.path.join(path_root, 'outputs')
 
 # ligands
-ls = read_ligands(path_ls)
 auxs = {'H': '[H-:1]', 'Cl': '[Cl-:1]', 'CO': '[C-:1]#[O+]'}
 
-
-#%% Prepare systems
-
 # params
 sp_params = {'geom': 'SP', 'CA': '[Pd+2]',
              'regime': 'CA', 'mTS': 12, 'mRS': 1, 'mer': True,
@@ -51,63 +57,215 @@ sp_params = {'geom': 'SP', 'CA': '[Pd+2]',
 oh_params = {'geom': 'OH', 'CA': '[Ru+2]',
              'regime': 'CA', 'mTS': None, 'mRS': 1, 'mer': True,
              'numConfs': 3, 'maxAttempts': 10}
-systems = []
 
-# SP
-for n, name, smiles in ls['SP']:
-    systems.append( (name, n, [smiles] + [auxs['CO']]*(4-n), sp_params, 'SP_CO') )
 
-# OH
-for n, name, smiles in ls['OH']:
-    systems.append( (name, n, [smiles] + [auxs['CO']]*(6-n), oh_params, 'OH_CO') )
+def get_systems(path, seed):
+    '''Returns list of systems; seeds are set before sharding'''
+    ls = read_ligands(path)
+    systems = []
+    # SP
+    for n, name, smiles in ls['SP']:
+        systems.append( (name, n, [smiles] + [auxs['CO']]*(4-n), sp_params, 'SP_CO') )
+    # OH
+    for n, name, smiles in ls['OH']:
+        systems.append( (name, n, [smiles] + [auxs['CO']]*(6-n), oh_params, 'OH_CO') )
+    # seeds
+    systems = [system + (seed + i,) for i, system in enumerate(systems)]
+    
+    return systems
 
 
-#%% Main code
+def get_shard(systems, shard):
+    '''Returns i-th of N shards given as "i/N" (i from 0 to N-1)'''
+    try:
+        i, N = [int(_) for _ in shard.split('/')]
+    except ValueError:
+        raise ValueError(f'Bad shard: {shard}; must be "i/N"')
+    if N < 1 or not 0 <= i < N:
+        raise ValueError(f'Bad shard: {shard}; i must be from 0 to N-1')
+    
+    return systems[i::N]
+
 
-# check subdirs
-subdirs = ['logs'] + list(set([_[4] for _ in systems]))
-for subdir in subdirs:
-    if not os.path.isdir(f'{path_xyz}/{subdir}'):
-        os.mkdir(f'{path_xyz}/{subdir}')
-
-# output initialization
-for subdir in set([_[-1] for _ in systems]):
-    with open(f'{path_xyz}/logs/{subdir}_temp.csv', 'w') as outf:
-        outf.write('complex,n,success,no3D,error,time\n')
-
-# generate systems
-for i, (basename, n, ligands, params, subdir) in enumerate(systems):
-    print(f'{i:>4} of {len(systems)}')
-    # params
-    geom = params['geom']
-    CA = params['CA']
-    regime = params['regime']
-    maxResonanceStructures = params['mRS']
-    minTransCycle = params['mTS']
-    merRule = params['mer']
-    numConfs = params['numConfs']
-    maxAttempts = params['maxAttempts']
-    result = {'err': 0, 'no3D': 0, 'success': 0}
+def run_system(system, saveXYZ = False):
+    '''Generates stereomers and conformers for the system; returns
+    per-ligand statistics
+    '''
+    basename, n, ligands, params, subdir, seed = system
+    result = {'name': basename, 'geom': params['geom'], 'n': n,
+              'stereomers': 0, 'success': 0, 'no3D': 0, 'confs': 0,
+              'err_search': 0, 'err_stereomers': 0}
     # stereomers
     t1 = time.time()
-    X = ComplexFromLigands(ligands, CA, geom, maxResonanceStructures)
-    Xs = X.GetStereomers(regime = regime, minTransCycle = minTransCycle, merRule = merRule)
+    try:
+        X = ComplexFromLigands(ligands, params['CA'], params['geom'], params['mRS'])
+        Xs = X.GetStereomers(regime = params['regime'], minTransCycle = params['mTS'],
+                             merRule = params['mer'])
+    except (SystemExit, KeyboardInterrupt):
+        raise
+    except:
+        Xs = []
+        result['err_search'] = 1
+    result['stereomers'] = len(Xs)
     # 3D
     for i, X in enumerate(Xs):
         try:
-            X.AddConformers(numConfs = numConfs, maxAttempts = maxAttempts)
+            X.AddConformers(numConfs = params['numConfs'], maxAttempts = params['maxAttempts'],
+                            randomSeed = seed)
         except (SystemExit, KeyboardInterrupt):
             raise
         except:
-            result['err'] += 1
+            result['err_stereomers'] += 1
             continue
         if X.GetNumConformers() == 0:
             result['no3D'] += 1
             continue
         result['success'] += 1
-        X.ToXYZ(f'{path_xyz}/{subdir}/{basename}_{i}.xyz', -1)
-    T = time.time() - t1
-    with open(f'{path_xyz}/logs/{subdir}_temp.csv', 'a') as outf:
-        outf.write(f'{basename},{n},{result["success"]},{result["no3D"]},{result["err"]},{T:.1f}\n')
+        result['confs'] += X.GetNumConformers()
+        if saveXYZ:
+            X.ToXYZ(f'{path_xyz}/{subdir}/{basename}_{i}.xyz', -1)
+    result['time'] = time.time() - t1
+    
+    return result
+
+
+#%% Statistics
+
+def get_stats(records, wallTime = None):
+    '''Returns throughput, failure rates, and latency percentiles.
+    Throughput per CPU second is calculated from the total time of
+    systems; throughput per second of wall time is measured only if
+    the wall time is given. Failure rates:
+        - system_error_rate: share of systems with failed stereomer search;
+        - stereomer_error_rate: share of stereomers with failed 3D generation;
+        - embed_failure_rate: share of stereomers without conformers among
+          those processed without errors
+    '''
+    if not records:
+        return {'systems': 0}
+    T = np.array([r['time'] for r in records])
+    n_stereo = sum([r['stereomers'] for r in records])
+    n_confs = sum([r['confs'] for r in records])
+    n_no3D = sum([r['no3D'] for r in records])
+    n_err_search = sum([r['err_search'] for r in records])
+    n_err_stereo = sum([r['err_stereomers'] for r in records])
+    n_processed = n_stereo - n_err_stereo
+    cpu_time = float(T.sum())
+    stats = {'systems': len(records),
+             'stereomers': n_stereo,
+             'confs': n_confs,
+             'cpu_time': cpu_time,
+             'complexes_per_cpu_sec': n_stereo / cpu_time if cpu_time else 0.0,
+             'confs_per_cpu_sec': n_confs / cpu_time if cpu_time else 0.0,
+             'embed_failure_rate': n_no3D / n_processed if n_processed else 0.0,
+             'system_error_rate': n_err_search / len(records),
+             'stereomer_error_rate': n_err_stereo / n_stereo if n_stereo else 0.0}
+    if wallTime is not None:
+        stats['complexes_per_sec'] = n_stereo / wallTime
+        stats['confs_per_sec'] = n_confs / wallTime
+    for q in (50, 95, 99):
+        stats[f'p{q}'] = float(np.percentile(T, q))
+    
+    return stats
+
 
+def get_report(records, wallTime):
+    '''Returns statistics for all systems with geometry and denticity
+    breakdowns. Subsets are processed simultaneously, so only their
+    throughput per CPU second is reported
+    '''
+    report = {'wall_time': wallTime, 'total': get_stats(records, wallTime),
+              'geom': {}, 'denticity': {}}
+    for key, field in (('geom', 'geom'), ('denticity', 'n')):
+        for value in sorted(set([r[field] for r in records])):
+            subset = [r for r in records if r[field] == value]
+            report[key][str(value)] = get_stats(subset)
+    report['records'] = records
+    
+    return report
+
+
+def print_report(report):
+    '''Prints the summary table; throughput of subsets is not measured
+    in wall time and is omitted (see get_report)
+    '''
+    fields = ('systems', 'stereomers', 'complexes_per_sec', 'confs_per_sec',
+              'complexes_per_cpu_sec', 'embed_failure_rate',
+              'system_error_rate', 'stereomer_error_rate', 'p50', 'p95', 'p99')
+    print(f'{"":<10}' + ''.join([f'{_:>22}' for _ in fields]))
+    rows = [('total', report['total'])]
+    rows += [(k, v) for k, v in report['geom'].items()]
+    rows += [(f'n={k}', v) for k, v in report['denticity'].items()]
+    for name, stats in rows:
+        values = [stats.get(_, '-') for _ in fields]
+        print(f'{name:<10}' + ''.join([f'{_:>22.3f}' if type(_) == float else f'{_:>22}' for _ in values]))
+    print(f'wall time: {report["wall_time"]:.1f} s')
+    
+    return
+
+
+#%% Main code
+
+def get_parser():
+    '''Generates CLI parser'''
+    parser = argparse.ArgumentParser(description = 'Throughput benchmark on CSD ligands')
+    parser.add_argument('--ligands', type = str, default = path_ls,
+                        help = 'path to the CSV file with ligands')
+    parser.add_argument('--shard', type = str, default = '0/1',
+                        help = 'shard to process, "i/N" with i from 0 to N-1')
+    parser.add_argument('--n-jobs', type = int, default = 1,
+                        help = 'number of worker processes')
+    parser.add_argument('--seed', type = int, default = 0,
+                        help = 'base random seed; seed of the ligand is base seed + its index')
+    parser.add_argument('--limit', type = int, default = None,
+                        help = 'maximal number of systems in the shard')
+    parser.add_argument('--save-xyz', action = 'store_true',
+                        help = f'saves lowest-energy conformers to {path_xyz}')
+    parser.add_argument('--report', type = str, default = None,
+                        help = 'path to JSON file to store the report')
+    parser.add_argument('--merge', type = str, nargs = '+', default = None,
+                        help = 'merges JSON reports of shards instead of running the benchmark; '
+                               'wall time is the maximal one over shards')
+    
+    return parser
+
+
+def main():
+    '''Runs the benchmark'''
+    args = get_parser().parse_args()
+    # merge shards
+    if args.merge:
+        records, wall_time = [], 0.0
+        for path in args.merge:
+            with open(path, 'r') as inpf:
+                shard = json.load(inpf)
+            records += shard['records']
+            wall_time = max(wall_time, shard['wall_time'])
+        report = get_report(records, wall_time)
+    # run benchmark
+    else:
+        systems = get_shard(get_systems(args.ligands, args.seed), args.shard)[:args.limit]
+        if args.save_xyz:
+            for subdir in set([_[4] for _ in systems]):
+                os.makedirs(f'{path_xyz}/{subdir}', exist_ok = True)
+        t0 = time.time()
+        records = []
+        with ProcessPoolExecutor(max_workers = args.n_jobs) as pool:
+            results = pool.map(run_system, systems, [args.save_xyz]*len(systems))
+            for i, result in enumerate(results):
+                print(f'{i+1:>4} of {len(systems)}: {result["name"]} {result["time"]:.1f} s')
+                records.append(result)
+        report = get_report(records, time.time() - t0)
+    # output
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as outf:
+            json.dump(report, outf, indent = 2)
+    
+    return
+
+
+if __name__ == '__main__':
+    
+    main()
 
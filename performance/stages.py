@@ -0,0 +1,260 @@
+'''
+Times stages of the Complex lifecycle for fixed representative systems
+and compares results with the stored baseline. Caches of mace are cleared
+before each measurement, so all stages are timed "cold". Timings depend
+on the machine, so the baseline should be generated on the same machine
+(--output) before the comparison (--baseline). If the host or CPU of the
+baseline differs, a warning is printed and times are compared relative
+to the median ratio over all stages, which estimates the speed of the
+machine; differences in Python or RDKit versions are reported as well
+
+Usage:
+    python stages.py [--repeats 5] [--output stages.json] [--baseline stages_baseline.json]
+'''
+
+#%% Imports
+
+import os, sys, time, json, platform, argparse, tempfile
+import statistics
+
+import numpy as np
+import rdkit
+from rdkit import Chem
+
+import mace
+from mace import _cache
+
+
+#%% Systems & stages
+
+# name: (ligands, CA, geom, regime)
+SYSTEMS = {
+    'SP_small': (['[Cl-:1]', '[N:2]#CC', 'c1cc[n:3]c(c1)-c1cccc[n:4]1'],
+                 '[Rh+]', 'SP', 'CA'),
+    'OH_bulky': (['[Cl-:1]', '[Cl-:2]',
+                  '[P:3](c1ccccc1)(c1ccccc1)c1ccccc1', '[P:4](c1ccccc1)(c1ccccc1)c1ccccc1',
+                  '[C-:5]#[O+]', '[C-:6]#[O+]'],
+                 '[Ru+2]', 'OH', 'CA'),
+    'OH_stereocenters': (['[NH2:1]C1CCCCC1[NH2:2]', '[NH2:3]C1CCCCC1[NH2:4]', '[Cl-:5]', '[Cl-:6]'],
+                         '[Co+3]', 'OH', 'all')
+}
+
+STAGES = ('init', 'comparison', 'stereomers', 'embedding', 'force_field',
+          'add_conformer', 'representative_confs', 'to_xyz_block', 'from_xyz_file')
+
+NUM_CONFS = 10
+
+
+def get_cpu_model():
+    '''Returns CPU model name (from /proc/cpuinfo on Linux)'''
+    try:
+        with open('/proc/cpuinfo', 'r') as inpf:
+            for line in inpf:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    
+    return platform.processor()
+
+
+def get_meta(repeats):
+    '''Returns info on the machine and versions of packages'''
+    meta = {'mace': mace.__version__, 'rdkit': rdkit.__version__,
+            'numpy': np.__version__, 'python': platform.python_version(),
+            'platform': platform.platform(), 'host': platform.node(),
+            'cpu': get_cpu_model(), 'cpu_count': os.cpu_count(),
+            'repeats': repeats}
+    
+    return meta
+
+
+def clear_caches():
+    '''Clears caches shared by complexes'''
+    mace.ClearComparisonCache()
+    _cache._BOUNDS_CACHE.Clear()
+    _cache._FF_TEMPLATE_CACHE.Clear()
+    
+    return
+
+
+def measure(func, setup, repeats):
+    '''Returns execution times of func(setup()); setup is not timed'''
+    times = []
+    for _ in range(repeats):
+        arg = setup()
+        clear_caches()
+        t0 = time.perf_counter()
+        func(arg)
+        times.append(time.perf_counter() - t0)
+    
+    return times
+
+
+def fresh(X):
+    '''Returns copy of the complex without prepared embedding and MM'''
+    
+    return mace.ComplexFromMol(Chem.Mol(X.mol), X.geom)
+
+
+def with_conformer(X):
+    '''Returns copy of the complex containing one conformer'''
+    Y = fresh(X)
+    Y.AddConformer()
+    Y._ff_prepared = False
+    Y._ff_cache = None
+    
+    return Y
+
+
+def run_system(name, repeats):
+    '''Times all stages for the system'''
+    ligands, CA, geom, regime = SYSTEMS[name]
+    smiles = mace.MolToSmiles(mace.ComplexFromLigands(ligands, CA, geom).mol)
+    X = mace.Complex(smiles, geom)
+    Xs = X.GetStereomers(regime)
+    Y = fresh(Xs[0])
+    Y.AddConformers(numConfs = NUM_CONFS)
+    block = Y.ToMultipleXYZBlock()
+    fd, path = tempfile.mkstemp(suffix = '.xyz')
+    with os.fdopen(fd, 'w') as outf:
+        outf.write(block)
+    # stages
+    times = {}
+    times['init'] = measure(lambda _: mace.Complex(smiles, geom), lambda: None, repeats)
+    times['comparison'] = measure(lambda X: X._SetComparison(), lambda: X, repeats)
+    times['stereomers'] = measure(lambda X: X.GetStereomers(regime), lambda: X, repeats)
+    times['embedding'] = measure(lambda X: X._SetEmbedding(), lambda: fresh(Xs[0]), repeats)
+    times['force_field'] = measure(lambda X: X._SetForceField(0), lambda: with_conformer(Xs[0]), repeats)
+    times['add_conformer'] = measure(lambda X: X.AddConformer(), lambda: fresh(Xs[0]), repeats)
+    # all conformers pass energy filters, so the RMSD matrix is calculated
+    times['representative_confs'] = measure(lambda X: X.GetRepresentativeConfs(3, np.inf, False),
+                                            lambda: Y, repeats)
+    times['to_xyz_block'] = measure(lambda X: X.ToMultipleXYZBlock(), lambda: Y, repeats)
+    times['from_xyz_file'] = measure(mace.ComplexFromXYZFile, lambda: path, repeats)
+    os.remove(path)
+    # stats
+    info = {'num_stereomers': len(Xs), 'num_atoms': Y.mol3D.GetNumAtoms(), 'stages': {}}
+    for stage in STAGES:
+        T = times[stage]
+        info['stages'][stage] = {'min': min(T), 'median': statistics.median(T),
+                                 'max': max(T), 'repeats': len(T)}
+    
+    return info
+
+
+#%% Comparison
+
+def check_meta(meta, ref):
+    '''Prints warnings on differences between the current machine and
+    the baseline one; returns True if the hardware differs
+    '''
+    for key in ('host', 'cpu', 'cpu_count', 'python', 'rdkit', 'numpy'):
+        if meta.get(key) != ref.get(key):
+            print(f'WARNING: {key} differs from the baseline: {meta.get(key)} vs {ref.get(key)}')
+    
+    return any([meta.get(key) != ref.get(key) for key in ('host', 'cpu', 'cpu_count')])
+
+
+def iter_pairs(results, baseline):
+    '''Yields system, stage, current and baseline minimal times'''
+    for name, info in results['systems'].items():
+        if name not in baseline['systems']:
+            continue
+        for stage, stats in info['stages'].items():
+            ref = baseline['systems'][name]['stages'].get(stage)
+            if ref is None:
+                continue
+            yield name, stage, stats['min'], ref['min']
+    
+    return
+
+
+def get_scale(results, baseline):
+    '''Returns median ratio of current times to the baseline ones'''
+    ratios = [t / t_ref for _, _, t, t_ref in iter_pairs(results, baseline) if t_ref]
+    
+    return statistics.median(ratios) if ratios else 1.0
+
+
+def compare(results, baseline, tolerance, minDiff, scale = 1.0):
+    '''Prints ratios of minimal times to the baseline ones (the minimum is
+    less affected by the system load than the median); returns the list
+    of regressed stages. Baseline times are multiplied by scale, the
+    relative speed of the current machine
+    '''
+    regressions = []
+    print(f'{"system":<18} {"stage":<22} {"baseline, ms":>12} {"current, ms":>12} {"ratio":>7}')
+    for name, stage, t, t_ref in iter_pairs(results, baseline):
+        t_ref *= scale
+        ratio = t / t_ref if t_ref else float('inf')
+        flag = ratio > 1 + tolerance and t - t_ref > minDiff
+        if flag:
+            regressions.append( (name, stage) )
+        print(f'{name:<18} {stage:<22} {1000*t_ref:>12.2f} {1000*t:>12.2f} {ratio:>7.2f}' + \
+              ('  REGRESSION' if flag else ''))
+    
+    return regressions
+
+
+#%% Main code
+
+def get_parser():
+    '''Generates CLI parser'''
+    parser = argparse.ArgumentParser(description = 'Stage-level benchmark of mace.Complex')
+    parser.add_argument('--repeats', type = int, default = 5,
+                        help = 'number of measurements per stage')
+    parser.add_argument('--systems', type = str, nargs = '+', default = list(SYSTEMS),
+                        choices = list(SYSTEMS), help = 'systems to benchmark')
+    parser.add_argument('--output', type = str, default = None,
+                        help = 'path to JSON file to store results')
+    parser.add_argument('--baseline', type = str, default = None,
+                        help = 'path to JSON file with the baseline results')
+    parser.add_argument('--tolerance', type = float, default = 0.25,
+                        help = 'maximal relative slowdown of the minimal time')
+    parser.add_argument('--min-diff', type = float, default = 0.001,
+                        help = 'slowdowns less than this time in seconds are ignored')
+    parser.add_argument('--normalize', type = str, default = 'auto',
+                        choices = ('auto', 'yes', 'no'),
+                        help = 'compare times relative to the median ratio over all stages; '
+                               '"auto" normalizes only if the host or CPU differs')
+    
+    return parser
+
+
+def main():
+    '''Runs benchmark; exits with code 1 if regressions are found'''
+    args = get_parser().parse_args()
+    results = {'meta': get_meta(args.repeats), 'systems': {}}
+    for name in args.systems:
+        print(f'{name}: running')
+        results['systems'][name] = run_system(name, args.repeats)
+    # output
+    if args.output:
+        with open(args.output, 'w') as outf:
+            json.dump(results, outf, indent = 2)
+            outf.write('\n')
+    if not args.baseline:
+        for name, info in results['systems'].items():
+            for stage, stats in info['stages'].items():
+                print(f'{name:<18} {stage:<22} {1000*stats["median"]:>10.2f} ms')
+        return
+    with open(args.baseline, 'r') as inpf:
+        baseline = json.load(inpf)
+    other_machine = check_meta(results['meta'], baseline['meta'])
+    scale = 1.0
+    if args.normalize == 'yes' or (args.normalize == 'auto' and other_machine):
+        scale = get_scale(results, baseline)
+        print(f'Baseline times are scaled by {scale:.2f} (median ratio over all stages)')
+    regressions = compare(results, baseline, args.tolerance, args.min_diff, scale)
+    if regressions:
+        print(f'{len(regressions)} regressions found')
+        sys.exit(1)
+    
+    return
+
+
+if __name__ == '__main__':
+    
+    main()
+
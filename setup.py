@@ -24,7 +24,8 @@ setuptools.setup(
       entry_points = {
           'console_scripts': [
               'epic-mace = mace.__main__:main',
-              'epic-mace-quickstart = mace._cli_quickstart:main'
+              'epic-mace-quickstart = mace._cli_quickstart:main',
+              'epic-mace-worker = mace.__main__:main_worker'
           ]
       },
       install_requires = [